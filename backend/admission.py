@@ -0,0 +1,135 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from config import settings
+
+# Headroom below the offline threshold for the agent's checks and the request itself
+SCHEDULE_MARGIN_SECONDS = 120
+
+class TokenBucket:
+    """Classic token bucket: ``capacity`` burst, one token every ``refill_seconds``"""
+
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated_at = now
+
+    def take(self, capacity: float, refill_seconds: float, now: float) -> float:
+        """Take a token; return 0 on success or the seconds until one is available"""
+        self.tokens = min(capacity, self.tokens + (now - self.updated_at) / refill_seconds)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) * refill_seconds
+
+class IngestRejected(Exception):
+    def __init__(self, status_code: int, retry_after: float, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+class AdmissionController:
+    """Per-worker admission control and check-in scheduling for agent ingest.
+
+    Each machine gets a token bucket so a misbehaving agent cannot flood the API,
+    ingest is shed with 503 once too many writes are in flight, and every accepted
+    check-in is told when to come back. The suggested delay is stretched while
+    write latency is above target, and each machine is steered onto a stable
+    phase within the interval so the fleet spreads out instead of arriving together.
+    """
+
+    def __init__(self, burst: int = None, refill_seconds: float = None, max_inflight: int = None,
+                 latency_target_ms: float = None, max_buckets: int = 100_000):
+        self.burst = burst or settings.ingest_burst
+        self.refill_seconds = refill_seconds or settings.ingest_refill_seconds
+        self.max_inflight = max_inflight or settings.ingest_max_inflight
+        self.latency_target = (latency_target_ms or settings.ingest_latency_target_ms) / 1000
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+        self._inflight = 0
+        self._latency = 0.0  # EWMA of ingest write time in seconds
+        self._lock = threading.Lock()
+
+    def admit(self, machine_id: str, kind: str = "check-in") -> None:
+        """Raise IngestRejected if this report should not be processed now
+
+        Each ``kind`` of report (check-ins, system checks) has its own bucket per machine.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._inflight >= self.max_inflight:
+                raise IngestRejected(503, self.base_interval() / 4, "Ingest overloaded, retry later")
+
+            key = (kind, machine_id)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.burst, now)
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_buckets:
+                    # Forget the least recently seen machine; it starts again with a full bucket
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            wait = bucket.take(self.burst, self.refill_seconds, now)
+        if wait:
+            raise IngestRejected(429, wait, "Check-in rate limit exceeded")
+
+    @contextmanager
+    def track(self, writes: int = 1):
+        """Count an ingest request as in flight and feed its duration into the load estimate
+
+        ``writes`` is how many reports the request stores (a replayed batch has many), so
+        the estimate stays per write.
+        """
+        with self._lock:
+            self._inflight += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._inflight -= 1
+                self._latency = 0.8 * self._latency + 0.2 * elapsed / max(writes, 1)
+
+    def load_factor(self) -> float:
+        """1.0 when healthy, up to 4.0 while writes are slow or ingest is saturated"""
+        latency_factor = self._latency / self.latency_target if self.latency_target else 1.0
+        inflight_factor = 2 * self._inflight / self.max_inflight
+        return min(4.0, max(1.0, latency_factor, inflight_factor))
+
+    def base_interval(self) -> float:
+        return settings.check_interval_minutes * 60 * self.load_factor()
+
+    def max_delay(self) -> float:
+        """Longest delay that still lands before the offline detector's deadline"""
+        deadline = settings.offline_threshold_minutes * 60 - settings.check_in_jitter_seconds
+        return max(60.0, deadline - SCHEDULE_MARGIN_SECONDS)
+
+    def schedule(self, machine_id: str, now: Optional[float] = None) -> dict:
+        """Seconds until this machine should check in next, plus a jitter window
+
+        Delays fall in [interval/2, 1.5 * interval), so the interval is capped to keep
+        even the latest check-in ahead of ``max_delay``; stretching under load must
+        never get healthy machines marked offline.
+        """
+        ceiling = self.max_delay()
+        interval = min(self.base_interval(), ceiling / 1.5)
+        now = time.time() if now is None else now
+        phase = zlib.crc32(machine_id.encode()) % max(int(interval), 1)
+        delay = (phase - now) % interval
+        if delay < interval / 2:
+            delay += interval
+        return {
+            "next_check_in_after": int(min(delay, ceiling)),
+            "jitter_seconds": settings.check_in_jitter_seconds
+        }
+
+admission = AdmissionController()
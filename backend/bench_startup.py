@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for the Solsphere API
+
+Measures, in fresh processes, how long it takes to import the app and how long
+a server takes from launch until it answers its first request.
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_SNIPPET = (
+    "import time; t = time.perf_counter(); import main; "
+    "print(time.perf_counter() - t)"
+)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def measure_import() -> float:
+    result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+def measure_first_request(timeout: float = 30.0) -> float:
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError("Server did not answer in time")
+    finally:
+        server.terminate()
+        server.wait()
+
+def _report(name: str, samples: list):
+    print(f"{name}: min {min(samples) * 1000:.1f} ms, "
+          f"median {statistics.median(samples) * 1000:.1f} ms, "
+          f"max {max(samples) * 1000:.1f} ms ({len(samples)} runs)")
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Solsphere API startup benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs (default: 5)")
+    args = parser.parse_args()
+
+    _report("import main", [measure_import() for _ in range(args.runs)])
+    _report("time to first request", [measure_first_request() for _ in range(args.runs)])
+
+if __name__ == "__main__":
+    main()
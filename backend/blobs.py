@@ -0,0 +1,142 @@
+"""
+Content-addressed storage for large system check details
+
+Details above ``detail_blob_min_bytes`` (package lists, antivirus listings) are
+stored once in ``check_detail_blobs`` under their SHA-256, compressed with zstd,
+and ``system_checks`` rows only carry the digest. A fleet on the same patch
+level reports the same text thousands of times, so each repeat costs an index
+probe instead of a row. Blobs never change, which makes them safe to cache
+forever in every worker; unreferenced ones are removed after old partitions are
+dropped.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import zstandard
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import CheckDetailBlob, SystemCheck
+from config import settings
+
+ZSTD_LEVEL = 10
+
+# zstd contexts are not thread-safe, so every worker thread gets its own pair
+_local = threading.local()
+
+def _compressor() -> zstandard.ZstdCompressor:
+    if not hasattr(_local, "compressor"):
+        _local.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return _local.compressor
+
+def _decompressor() -> zstandard.ZstdDecompressor:
+    if not hasattr(_local, "decompressor"):
+        _local.decompressor = zstandard.ZstdDecompressor()
+    return _local.decompressor
+
+class BlobCache:
+    """LRU of decompressed blobs; entries never go stale because blobs are immutable"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: str) -> Optional[str]:
+        with self._lock:
+            text = self._entries.get(digest)
+            if text is not None:
+                self._entries.move_to_end(digest)
+            return text
+
+    def put(self, digest: str, text: str) -> None:
+        with self._lock:
+            self._entries[digest] = text
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+blob_cache = BlobCache(settings.detail_blob_cache_size)
+
+def digest_of(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def should_store(details: Optional[str]) -> bool:
+    # The threshold, like the size column, is in UTF-8 bytes, not characters
+    return details is not None and len(details.encode("utf-8")) >= settings.detail_blob_min_bytes
+
+def store(conn: Connection, text: str) -> str:
+    """Save ``text`` as a blob unless it already exists, returning its digest"""
+    digest = digest_of(text)
+    raw = text.encode("utf-8")
+    values = {"digest": digest, "data": _compressor().compress(raw), "size": len(raw)}
+    table = CheckDetailBlob.__table__
+    if conn.dialect.name == "postgresql":
+        # The share lock keeps collect_garbage from deleting the blob before the check
+        # referring to it commits; if a collection removed it first, insert it again
+        while True:
+            conn.execute(postgresql.insert(table).values(**values).on_conflict_do_nothing())
+            held = select(table.c.digest).where(table.c.digest == digest).with_for_update(read=True)
+            if conn.execute(held).first() is not None:
+                break
+    elif conn.dialect.name == "sqlite":
+        conn.execute(sqlite.insert(table).values(**values).on_conflict_do_nothing())
+    elif conn.execute(select(table.c.digest).where(table.c.digest == digest)).first() is None:
+        conn.execute(insert(table).values(**values))
+    blob_cache.put(digest, text)
+    return digest
+
+def load(conn: Connection, digests: Iterable[str]) -> Dict[str, str]:
+    """Texts for ``digests``, reading only the ones not cached yet in one query"""
+    found, missing = {}, set()
+    for digest in digests:
+        text = blob_cache.get(digest)
+        if text is None:
+            missing.add(digest)
+        else:
+            found[digest] = text
+    if missing:
+        table = CheckDetailBlob.__table__
+        rows = conn.execute(select(table.c.digest, table.c.data).where(table.c.digest.in_(missing)))
+        for digest, data in rows:
+            text = _decompressor().decompress(data).decode("utf-8")
+            blob_cache.put(digest, text)
+            found[digest] = text
+    return found
+
+def resolve_details(conn: Connection, checks: List[SystemCheck]) -> List[SystemCheck]:
+    """Fill in ``details`` of checks whose text lives in a blob, without dirtying them"""
+    digests = {check.details_digest for check in checks if check.details_digest and check.details is None}
+    if digests:
+        texts = load(conn, digests)
+        for check in checks:
+            if check.details_digest in texts and check.details is None:
+                set_committed_value(check, "details", texts[check.details_digest])
+    return checks
+
+def collect_garbage(conn: Connection) -> int:
+    """Delete blobs no remaining check refers to; returns how many went"""
+    table = CheckDetailBlob.__table__
+    referenced = select(SystemCheck.__table__.c.details_digest).where(
+        SystemCheck.__table__.c.details_digest.isnot(None)
+    )
+    unreferenced = table.c.digest.notin_(referenced)
+    if conn.dialect.name == "postgresql":
+        # Lock the candidates first: that waits out store() calls reusing one of them.
+        # The DELETE then re-checks references with a fresh (READ COMMITTED) snapshot
+        # that sees those checks, and later store() calls wait on the locks instead.
+        candidates = conn.execute(select(table.c.digest).where(unreferenced).with_for_update()).scalars().all()
+        if not candidates:
+            return 0
+        return conn.execute(delete(table).where(table.c.digest.in_(candidates), unreferenced)).rowcount
+    # SQLite runs one write transaction at a time, so store() cannot interleave
+    return conn.execute(delete(table).where(unreferenced)).rowcount
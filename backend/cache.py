@@ -0,0 +1,106 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List
+
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import ChangeCounter
+from config import settings
+
+# Counter bumped by every write that changes current machine state
+MACHINES_COUNTER = "machines"
+
+# Local caches per counter name, so a write in this worker is visible immediately
+_registry: Dict[str, List["VersionedCache"]] = {}
+
+def ensure_counters(db: Session, *names: str) -> None:
+    """Create missing change counter rows (safe to call from every worker)"""
+    for name in names:
+        if db.get(ChangeCounter, name) is None:
+            db.add(ChangeCounter(name=name, version=0))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another worker created it first
+                db.rollback()
+
+def watch_counter(name: str, cache: Any) -> None:
+    """Have ``cache.mark_stale()`` called whenever this worker commits a bump of ``name``"""
+    _registry.setdefault(name, []).append(cache)
+
+def bump_version(db: Session, name: str) -> int:
+    """Increment a change counter inside the caller's transaction and return its new version"""
+    version = db.execute(
+        update(ChangeCounter)
+        .where(ChangeCounter.name == name)
+        .values(version=ChangeCounter.version + 1)
+        .returning(ChangeCounter.version)
+    ).scalar()
+    if version is None:
+        version = 1
+        db.add(ChangeCounter(name=name, version=version))
+    # Local caches are marked stale only once this change commits; before that a
+    # concurrent read would refill them from the old data and keep it
+    db.info.setdefault("bumped_counters", set()).add(name)
+    return version
+
+@event.listens_for(Session, "after_commit")
+def _mark_bumped_stale(session: Session) -> None:
+    for name in session.info.pop("bumped_counters", ()):
+        for cache in _registry.get(name, []):
+            cache.mark_stale()
+
+@event.listens_for(Session, "after_rollback")
+def _forget_bumps(session: Session) -> None:
+    session.info.pop("bumped_counters", None)
+
+def get_version(db: Session, name: str) -> int:
+    counter = db.get(ChangeCounter, name, populate_existing=True)
+    return counter.version if counter else 0
+
+class VersionedCache:
+    """Per-process cache that stays consistent across workers.
+
+    Entries are tagged with the version of a DB-backed change counter. Writers in any
+    worker bump the counter in the same transaction as their change; readers re-check
+    it at most every ``poll_seconds`` and drop entries built from an older version.
+    """
+
+    def __init__(self, counter: str, poll_seconds: float = None):
+        self.counter = counter
+        self.poll_seconds = settings.cache_poll_seconds if poll_seconds is None else poll_seconds
+        self._entries: Dict[Hashable, tuple] = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        watch_counter(counter, self)
+
+    def mark_stale(self) -> None:
+        """Force the next read to re-check the counter"""
+        self._checked_at = 0.0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        self.mark_stale()
+
+    def _current_version(self, db: Session) -> int:
+        now = time.monotonic()
+        if self._version is None or now - self._checked_at >= self.poll_seconds:
+            self._version = get_version(db, self.counter)
+            self._checked_at = now
+        return self._version
+
+    def get(self, db: Session, key: Hashable, loader: Callable[[Session], Any]) -> Any:
+        version = self._current_version(db)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        value = loader(db)
+        with self._lock:
+            self._entries[key] = (version, value)
+        return value
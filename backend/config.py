@@ -5,6 +5,12 @@ from typing import Optional
 class Settings(BaseSettings):
     # Database
     database_url: str = "sqlite:///./solsphere.db"
+    database_echo: bool = False
+    database_pool_size: int = 10
+    database_max_overflow: int = 20
+    auto_migrate: bool = True  # Apply pending migrations on startup
+    database_replica_urls: list = []  # Read-only replicas for GET endpoints, e.g. '["postgresql://..."]'
+    read_your_writes_seconds: float = 10.0  # Clients that just wrote keep reading from the primary this long
     
     # Security
     secret_key: str = "your-secret-key-change-in-production"
@@ -17,9 +23,36 @@ class Settings(BaseSettings):
     # API
     api_prefix: str = "/api"
     
+    # Server
+    workers: int = 0  # 0 = one worker per CPU core
+    graceful_shutdown_seconds: int = 30
+    cache_poll_seconds: float = 1.0
+    fleet_index: bool = False  # Serve machine lists and dashboard counts from an in-memory index per worker
+    
     # System checks
     check_interval_minutes: int = 30
     max_check_history: int = 100
+    check_retention_months: int = 12  # Whole months of system_checks kept; 0 keeps everything
+    detail_blob_min_bytes: int = 1024  # Check details at least this long are deduplicated into check_detail_blobs
+    detail_blob_cache_size: int = 1024  # Decompressed blobs kept in memory per worker
+    
+    # Ingest admission control
+    ingest_burst: int = 5  # Reports a single machine may send back to back
+    ingest_refill_seconds: float = 60.0  # One more report allowed per machine every N seconds
+    ingest_max_inflight: int = 64  # Per worker; further reports get 503 until writes drain
+    ingest_latency_target_ms: float = 250.0  # Check-in intervals stretch while writes are slower
+    check_in_jitter_seconds: int = 60
+    max_batch_reports: int = 500  # Spooled reports accepted per /api/machines/batch request
+    max_request_body_bytes: int = 16 * 1024 * 1024  # After undoing Content-Encoding
+    
+    # Offline detection
+    offline_threshold_minutes: int = 60
+    offline_scan_interval_seconds: int = 60
+    
+    # Compliance snapshots
+    snapshot_interval_minutes: int = 15
+    hourly_snapshots: bool = True
+    hourly_snapshot_retention_days: int = 14
     
     class Config:
         env_file = ".env"
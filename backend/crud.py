@@ -1,11 +1,59 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
-from typing import List, Optional
-from datetime import datetime, timedelta
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import and_, or_, select, update, delete, func, case
+from typing import List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import base64
 import uuid
 
-from models import Machine, SystemCheck, User
-from schemas import MachineCreate, MachineUpdate, SystemCheckCreate, UserCreate
+from models import Machine, MachineEvent, SystemCheck, ComplianceSnapshot, User
+from schemas import MachineCreate, MachineFilter, MachineUpdate, SystemCheckCreate, UserCreate
+from cache import bump_version, MACHINES_COUNTER
+import partitions
+import blobs
+
+MACHINE_STATUSES = ["healthy", "warning", "critical", "offline"]
+
+# What GET /api/machines can project: every column plus the derived issue count
+MACHINE_FIELDS = [column.name for column in Machine.__table__.columns] + ["issue_count"]
+# Server-side sorting is limited to columns an index can serve (alone or as leading column)
+SORTABLE_MACHINE_FIELDS = {"machine_id", "last_check_in", "status", "operating_system"}
+
+# Telemetry that changes on every report; updating it is not a state change
+METRIC_FIELDS = {"cpu_usage", "memory_usage", "disk_usage", "network_status", "metrics_summary"}
+
+def derive_status(machine: Machine) -> str:
+    """Health status stored on the machine row, kept current by every write path"""
+    if machine.is_online is False:
+        return "offline"
+    issues = machine.issues or []
+    if any(issue.get("severity") == "critical" for issue in issues):
+        return "critical"
+    if issues:
+        return "warning"
+    return "healthy"
+
+def issue_count_column(db: Session):
+    """SQL expression for the number of issues, without shipping the issues JSON"""
+    if db.get_bind().dialect.name == "postgresql":
+        # json_array_length rejects JSON null and other scalars
+        return case((func.json_typeof(Machine.issues) == "array", func.json_array_length(Machine.issues)), else_=0)
+    return func.coalesce(func.json_array_length(Machine.issues), 0)
+
+def _stamp_change(db: Session, machine_ids: List[str]) -> None:
+    """Bump the machines counter and record its new version on rows changed by a bulk UPDATE"""
+    version = bump_version(db, MACHINES_COUNTER)
+    db.execute(
+        update(Machine)
+        .where(Machine.machine_id.in_(machine_ids))
+        .values(change_version=version, updated_at=Machine.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+
+def _deleted_event(machine_id: str, hostname: str, timestamp: datetime) -> MachineEvent:
+    # The machine row is gone afterwards, so the event keeps its hostname
+    return MachineEvent(machine_id=machine_id, event_type="deleted",
+                        details=f"Machine {hostname or machine_id} deleted", timestamp=timestamp)
 
 # Machine CRUD operations
 class MachineCRUD:
@@ -20,6 +68,8 @@ class MachineCRUD:
             antivirus_active=machine.antivirus_active,
             sleep_settings_compliant=machine.sleep_settings_compliant
         )
+        db_machine.status = derive_status(db_machine)
+        db_machine.change_version = bump_version(db, MACHINES_COUNTER)
         db.add(db_machine)
         db.commit()
         db.refresh(db_machine)
@@ -28,9 +78,123 @@ class MachineCRUD:
     def get(self, db: Session, machine_id: str) -> Optional[Machine]:
         return db.query(Machine).filter(Machine.machine_id == machine_id).first()
 
+    def check_in(self, db: Session, machine: MachineCreate) -> Machine:
+        """Create or update a machine from an agent report and mark it online"""
+        db_machine = self.get(db, machine.machine_id)
+        # Replayed reports date their events to when they were collected
+        event_time = getattr(machine, "collected_at", None) or datetime.utcnow()
+        if event_time.tzinfo is not None:
+            event_time = event_time.astimezone(timezone.utc).replace(tzinfo=None)
+        changed = db_machine is None
+        if not db_machine:
+            db_machine = Machine(machine_id=machine.machine_id)
+            db.add(db_machine)
+            db.add(MachineEvent(machine_id=machine.machine_id, event_type="registered",
+                                details="Machine registered", timestamp=event_time))
+        
+        for field, value in machine.dict(exclude_unset=True, exclude={"collected_at"}).items():
+            if getattr(db_machine, field) != value:
+                setattr(db_machine, field, value)
+                changed = changed or field not in METRIC_FIELDS
+        
+        now = datetime.utcnow()
+        db_machine.last_check_in = now
+        db_machine.updated_at = now
+        if db_machine.is_online is False:
+            db.add(MachineEvent(machine_id=machine.machine_id, event_type="online",
+                                details="Machine checked in", timestamp=event_time))
+            changed = True
+        db_machine.is_online = True
+        
+        old_status, new_status = db_machine.status, derive_status(db_machine)
+        if old_status != new_status:
+            db_machine.status = new_status
+            if old_status not in (None, "offline"):
+                db.add(MachineEvent(machine_id=machine.machine_id, event_type="status",
+                                    details=f"{old_status} -> {new_status}", timestamp=event_time))
+            changed = True
+        # Only state changes invalidate caches, so steady-state check-ins never
+        # contend on the counter row
+        if changed:
+            db_machine.change_version = bump_version(db, MACHINES_COUNTER)
+        db.commit()
+        db.refresh(db_machine)
+        return db_machine
+
+    def heartbeat(self, db: Session, machine_id: str, metrics_summary: Optional[dict] = None) -> bool:
+        """Bump last_check_in for an unchanged machine; False if the machine is unknown"""
+        now = datetime.utcnow()
+        values = {"last_check_in": now}
+        if metrics_summary:
+            values["metrics_summary"] = metrics_summary
+        result = db.execute(
+            update(Machine)
+            .where(Machine.machine_id == machine_id, Machine.is_online.is_(True))
+            .values(**values)
+        )
+        if result.rowcount:
+            db.commit()
+            return True
+        
+        db_machine = self.get(db, machine_id)
+        if not db_machine:
+            db.rollback()
+            return False
+        # Coming back from offline is a state change, same as in check_in
+        for field, value in values.items():
+            setattr(db_machine, field, value)
+        db_machine.is_online = True
+        db_machine.status = derive_status(db_machine)
+        db.add(MachineEvent(machine_id=machine_id, event_type="online", details="Machine checked in",
+                            timestamp=now))
+        db_machine.change_version = bump_version(db, MACHINES_COUNTER)
+        db.commit()
+        return True
+
     def get_multi(self, db: Session, skip: int = 0, limit: int = 100) -> List[Machine]:
         return db.query(Machine).offset(skip).limit(limit).all()
 
+    def get_projection(
+        self,
+        db: Session,
+        fields: List[str],
+        sort: Optional[List[Tuple[str, bool]]] = None,
+        skip: int = 0,
+        limit: int = 100,
+        os_filter: Optional[str] = None,
+        status_filter: Optional[str] = None,
+        search: Optional[str] = None
+    ) -> List[dict]:
+        """Only ``fields`` of each machine, selected as plain rows without building ORM objects.
+
+        ``sort`` is a list of (field, descending) pairs; machine_id always breaks ties so
+        pages are stable. Filters and ``search`` (a hostname or machine ID substring) run
+        in SQL, before paging.
+        """
+        columns = [
+            issue_count_column(db).label("issue_count") if field == "issue_count" else Machine.__table__.c[field]
+            for field in fields
+        ]
+        query = select(*columns)
+        if os_filter:
+            query = query.where(Machine.operating_system.icontains(os_filter, autoescape=True))
+        if status_filter == "offline":
+            query = query.where(or_(Machine.status == "offline", Machine.last_check_in.is_(None)))
+        elif status_filter:
+            query = query.where(Machine.status == status_filter, Machine.last_check_in.isnot(None))
+        if search:
+            query = query.where(or_(Machine.hostname.icontains(search, autoescape=True),
+                                    Machine.machine_id.icontains(search, autoescape=True)))
+        
+        # NULLs sort as the largest value on every backend (SQLite defaults to the opposite)
+        order = [Machine.__table__.c[field].desc().nulls_first() if descending
+                 else Machine.__table__.c[field].asc().nulls_last()
+                 for field, descending in sort or []]
+        if "machine_id" not in {field for field, _ in sort or []}:
+            order.append(Machine.machine_id.asc())
+        query = query.order_by(*order).offset(skip).limit(limit)
+        return [dict(row._mapping) for row in db.execute(query)]
+
     def update(self, db: Session, machine_id: str, machine_update: MachineUpdate) -> Optional[Machine]:
         db_machine = self.get(db, machine_id)
         if not db_machine:
@@ -40,7 +204,9 @@ class MachineCRUD:
         for field, value in update_data.items():
             setattr(db_machine, field, value)
         
+        db_machine.status = derive_status(db_machine)
         db_machine.updated_at = datetime.utcnow()
+        db_machine.change_version = bump_version(db, MACHINES_COUNTER)
         db.commit()
         db.refresh(db_machine)
         return db_machine
@@ -51,48 +217,59 @@ class MachineCRUD:
             return False
         
         db.delete(db_machine)
+        db.add(_deleted_event(db_machine.machine_id, db_machine.hostname, datetime.utcnow()))
+        bump_version(db, MACHINES_COUNTER)
         db.commit()
         return True
 
     def count(self, db: Session) -> int:
         return db.query(Machine).count()
 
+    def count_offline(self, db: Session) -> int:
+        return db.query(Machine).filter(Machine.is_online.is_(False)).count()
+
+    def count_by_status(self, db: Session) -> dict:
+        counts = dict.fromkeys(MACHINE_STATUSES, 0)
+        for status, count in db.query(Machine.status, func.count(Machine.machine_id)).group_by(Machine.status):
+            counts[status] = count
+        return counts
+
     def count_healthy(self, db: Session) -> int:
-        # Count machines with no issues and recent check-ins
-        cutoff_time = datetime.utcnow() - timedelta(hours=1)
-        return db.query(Machine).filter(
-            and_(
-                Machine.last_check_in > cutoff_time,
-                or_(
-                    Machine.issues.is_(None),
-                    Machine.issues == []
-                )
-            )
-        ).count()
+        return db.query(Machine).filter(Machine.status == "healthy").count()
 
     def count_warnings(self, db: Session) -> int:
-        # Count machines with warnings but no critical issues
-        cutoff_time = datetime.utcnow() - timedelta(hours=1)
-        return db.query(Machine).filter(
-            and_(
-                Machine.last_check_in > cutoff_time,
-                Machine.issues.isnot(None),
-                Machine.issues != [],
-                ~Machine.issues.any(lambda x: x.get('severity') == 'critical')
-            )
-        ).count()
+        return db.query(Machine).filter(Machine.status == "warning").count()
 
     def count_critical(self, db: Session) -> int:
-        # Count machines with critical issues
-        cutoff_time = datetime.utcnow() - timedelta(hours=1)
-        return db.query(Machine).filter(
-            and_(
-                Machine.last_check_in > cutoff_time,
-                Machine.issues.isnot(None),
-                Machine.issues != [],
-                Machine.issues.any(lambda x: x.get('severity') == 'critical')
-            )
-        ).count()
+        return db.query(Machine).filter(Machine.status == "critical").count()
+
+    def get_distribution(self, db: Session) -> dict:
+        """Fleet breakdown by OS, OS version and status from a single GROUP BY"""
+        rows = db.query(
+            Machine.operating_system, Machine.os_version, Machine.status, func.count(Machine.machine_id)
+        ).group_by(Machine.operating_system, Machine.os_version, Machine.status).all()
+        
+        total = sum(row[3] for row in rows)
+        by_os, by_version, status_by_os = {}, {}, {}
+        for operating_system, os_version, status, count in rows:
+            by_os[operating_system] = by_os.get(operating_system, 0) + count
+            version_key = (operating_system, os_version)
+            by_version[version_key] = by_version.get(version_key, 0) + count
+            statuses = status_by_os.setdefault(operating_system, dict.fromkeys(MACHINE_STATUSES, 0))
+            statuses[status] = statuses.get(status, 0) + count
+        
+        return {
+            "total_machines": total,
+            "operating_systems": [
+                {"name": name, "count": count, "percentage": round(count / total * 100, 1)}
+                for name, count in sorted(by_os.items(), key=lambda item: -item[1])
+            ],
+            "os_versions": [
+                {"operating_system": os_name, "os_version": version, "count": count}
+                for (os_name, version), count in sorted(by_version.items(), key=lambda item: -item[1])
+            ],
+            "status_by_os": status_by_os
+        }
 
     def get_by_os(self, db: Session, os_name: str) -> List[Machine]:
         return db.query(Machine).filter(
@@ -108,33 +285,374 @@ class MachineCRUD:
             )
         ).all()
 
+    def _filter_conditions(self, machine_filter: MachineFilter) -> list:
+        conditions = []
+        if machine_filter.machine_ids is not None:
+            conditions.append(Machine.machine_id.in_(machine_filter.machine_ids))
+        if machine_filter.operating_system:
+            conditions.append(Machine.operating_system == machine_filter.operating_system)
+        if machine_filter.os_version:
+            conditions.append(Machine.os_version == machine_filter.os_version)
+        if machine_filter.hostname_prefix:
+            conditions.append(Machine.hostname.startswith(machine_filter.hostname_prefix, autoescape=True))
+        if machine_filter.status:
+            conditions.append(Machine.status == machine_filter.status)
+        if machine_filter.offline_for_days:
+            cutoff = datetime.utcnow() - timedelta(days=machine_filter.offline_for_days)
+            conditions.append(or_(Machine.last_check_in.is_(None), Machine.last_check_in < cutoff))
+        if not conditions:
+            # Never let an empty filter touch the whole fleet
+            raise ValueError("A bulk operation needs at least one filter criterion")
+        return conditions
+
+    def bulk_update(self, db: Session, machine_filter: MachineFilter, changes: MachineUpdate,
+                    batch_size: int = 500) -> int:
+        """Apply ``changes`` to every matching machine; returns how many were updated.
+
+        Runs one UPDATE per batch of up to ``batch_size`` rows, walking machine_id
+        order (as the database sorts it) so each row is visited once, and commits
+        every batch with a change counter bump like a single update.
+        """
+        conditions = self._filter_conditions(machine_filter)
+        values = changes.dict(exclude_unset=True)
+        if not values:
+            return 0
+        if "issues" in values:
+            # Status follows the new issues, except for machines that are offline
+            online_status = derive_status(Machine(is_online=True, issues=values["issues"]))
+            values["status"] = case((Machine.is_online.is_(False), "offline"), else_=online_status)
+        
+        updated, last_id = 0, None
+        while True:
+            batch = select(Machine.machine_id).where(*conditions)
+            if last_id is not None:
+                batch = batch.where(Machine.machine_id > last_id)
+            machine_ids = db.execute(batch.order_by(Machine.machine_id).limit(batch_size)).scalars().all()
+            if not machine_ids:
+                db.rollback()
+                return updated
+            db.execute(
+                update(Machine)
+                .where(Machine.machine_id.in_(machine_ids))
+                .values(**values, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            _stamp_change(db, machine_ids)
+            db.commit()
+            updated += len(machine_ids)
+            last_id = machine_ids[-1]
+            if len(machine_ids) < batch_size:
+                return updated
+
+    def bulk_delete(self, db: Session, machine_filter: MachineFilter, batch_size: int = 500) -> int:
+        """Delete every matching machine in batches of ``batch_size``; returns how many went"""
+        conditions = self._filter_conditions(machine_filter)
+        deleted = 0
+        while True:
+            batch = select(Machine.machine_id).where(*conditions).limit(batch_size)
+            rows = db.execute(
+                delete(Machine)
+                .where(Machine.machine_id.in_(batch))
+                .returning(Machine.machine_id, Machine.hostname)
+                .execution_options(synchronize_session=False)
+            ).all()
+            count = len(rows)
+            if not count:
+                db.rollback()
+                return deleted
+            now = datetime.utcnow()
+            db.add_all([_deleted_event(machine_id, hostname, now) for machine_id, hostname in rows])
+            bump_version(db, MACHINES_COUNTER)
+            db.commit()
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+    def mark_offline(self, db: Session, cutoff_time: datetime, batch_size: int = 500) -> List[str]:
+        """Flip online machines whose last check-in is older than cutoff_time to offline.
+
+        Only rows that are still online are touched, so each transition is recorded once.
+        Returns the IDs of machines that went offline in this batch.
+        """
+        expired = select(Machine.machine_id).where(
+            Machine.is_online.is_(True),
+            or_(
+                Machine.last_check_in.is_(None),
+                Machine.last_check_in < cutoff_time
+            )
+        ).limit(batch_size)
+        result = db.execute(
+            update(Machine)
+            .where(Machine.machine_id.in_(expired), Machine.is_online.is_(True))
+            .values(is_online=False, status="offline")
+            .returning(Machine.machine_id)
+            .execution_options(synchronize_session=False)
+        )
+        machine_ids = [row.machine_id for row in result]
+        
+        details = f"No check-in since {cutoff_time.isoformat()}"
+        now = datetime.utcnow()
+        db.add_all([
+            MachineEvent(machine_id=machine_id, event_type="offline", details=details, timestamp=now)
+            for machine_id in machine_ids
+        ])
+        if machine_ids:
+            _stamp_change(db, machine_ids)
+        db.commit()
+        return machine_ids
+
 # System Check CRUD operations
+def encode_cursor(check: SystemCheck) -> str:
+    """Opaque keyset cursor pointing just past ``check`` in newest-first order"""
+    raw = f"{check.timestamp.isoformat()}|{check.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    timestamp, check_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(timestamp), int(check_id)
+
 class SystemCheckCRUD:
     def create(self, db: Session, check: SystemCheckCreate) -> SystemCheck:
-        db_check = SystemCheck(
-            machine_id=check.machine_id,
-            check_type=check.check_type,
-            status=check.status,
-            details=check.details
-        )
-        db.add(db_check)
-        db.commit()
-        db.refresh(db_check)
+        previous = self.get_latest(db, check.machine_id, check.check_type)
+        values = {
+            "machine_id": check.machine_id,
+            "check_type": check.check_type,
+            "status": check.status,
+            "status_changed": previous is None or previous.status != check.status,
+            "details": check.details,
+            "details_digest": None,
+            # Set explicitly so the row is routed to the right month partition
+            "timestamp": datetime.utcnow()
+        }
+        conn = db.connection()
+        if blobs.should_store(check.details):
+            # Large details are shared by many checks; store them once, in the same transaction
+            values["details"] = None
+            values["details_digest"] = blobs.store(conn, check.details)
+        if partitions.dialect_of(conn) == "sqlite" and partitions.is_partitioned(conn):
+            check_id = partitions.insert_check(conn, values)
+            db.commit()
+            db_check = SystemCheck(id=check_id, **values)
+        else:
+            db_check = SystemCheck(**values)
+            db.add(db_check)
+            db.commit()
+            db.refresh(db_check)
+        if db_check.details_digest:
+            set_committed_value(db_check, "details", check.details)
         return db_check
 
     def get(self, db: Session, check_id: int) -> Optional[SystemCheck]:
         return db.query(SystemCheck).filter(SystemCheck.id == check_id).first()
 
+    def _query_partition(self, db: Session, month: Optional[datetime]):
+        """Query one month partition (or the whole table when unpartitioned)"""
+        entity = partitions.entity_for(db.connection(), month)
+        query = db.query(entity)
+        if month is not None:
+            # Explicit bounds let PostgreSQL prune to a single partition
+            query = query.filter(
+                entity.timestamp >= month,
+                entity.timestamp < partitions.next_month(month)
+            )
+        return entity, query
+
     def get_by_machine(self, db: Session, machine_id: str, limit: int = 50) -> List[SystemCheck]:
-        return db.query(SystemCheck).filter(
-            SystemCheck.machine_id == machine_id
-        ).order_by(SystemCheck.timestamp.desc()).limit(limit).all()
+        # Walk partitions newest first and stop as soon as the page is full
+        checks = []
+        for month in partitions.months_in_range(db.connection()):
+            entity, query = self._query_partition(db, month)
+            checks.extend(query.filter(
+                entity.machine_id == machine_id
+            ).order_by(entity.timestamp.desc()).limit(limit - len(checks)).all())
+            if len(checks) >= limit:
+                break
+        return blobs.resolve_details(db.connection(), checks)
+
+    def get_latest(self, db: Session, machine_id: str, check_type: str) -> Optional[SystemCheck]:
+        for month in partitions.months_in_range(db.connection()):
+            entity, query = self._query_partition(db, month)
+            latest = query.filter(
+                entity.machine_id == machine_id,
+                entity.check_type == check_type
+            ).order_by(entity.timestamp.desc(), entity.id.desc()).first()
+            if latest is not None:
+                return latest
+        return None
+
+    def get_history(
+        self,
+        db: Session,
+        machine_id: str,
+        limit: int = 50,
+        cursor: Optional[Tuple[datetime, int]] = None,
+        check_type: Optional[str] = None,
+        status: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        changes_only: bool = False
+    ) -> Tuple[List[SystemCheck], bool]:
+        """Newest-first keyset page on (timestamp, id).
+
+        Returns the page and whether older rows remain. Only partitions between
+        ``since`` and the cursor are visited, so cost is proportional to the page.
+        """
+        upper = cursor[0] if cursor else until
+        months = partitions.months_in_range(
+            db.connection(), since=since,
+            until=partitions.next_month(partitions.month_start(upper)) if upper else None
+        )
+        
+        checks = []
+        for month in months:
+            entity, query = self._query_partition(db, month)
+            query = query.filter(entity.machine_id == machine_id)
+            if check_type:
+                query = query.filter(entity.check_type == check_type)
+            if status:
+                query = query.filter(entity.status == status)
+            if changes_only:
+                query = query.filter(entity.status_changed.is_(True))
+            if since:
+                query = query.filter(entity.timestamp >= since)
+            if until:
+                query = query.filter(entity.timestamp < until)
+            if cursor:
+                query = query.filter(or_(
+                    entity.timestamp < cursor[0],
+                    and_(entity.timestamp == cursor[0], entity.id < cursor[1])
+                ))
+            # One extra row tells us whether another page exists
+            checks.extend(query.order_by(
+                entity.timestamp.desc(), entity.id.desc()
+            ).limit(limit + 1 - len(checks)).all())
+            if len(checks) > limit:
+                break
+        return blobs.resolve_details(db.connection(), checks[:limit]), len(checks) > limit
 
     def get_recent_checks(self, db: Session, hours: int = 24) -> List[SystemCheck]:
         cutoff_time = datetime.utcnow() - timedelta(hours=hours)
-        return db.query(SystemCheck).filter(
-            SystemCheck.timestamp > cutoff_time
-        ).order_by(SystemCheck.timestamp.desc()).all()
+        checks = []
+        for month in partitions.months_in_range(db.connection(), since=cutoff_time):
+            entity, query = self._query_partition(db, month)
+            checks.extend(query.filter(
+                entity.timestamp > cutoff_time
+            ).order_by(entity.timestamp.desc()).all())
+        return blobs.resolve_details(db.connection(), checks)
+
+# Machine event CRUD operations
+class MachineEventCRUD:
+    def create(self, db: Session, machine_id: str, event_type: str, details: Optional[str] = None) -> MachineEvent:
+        db_event = MachineEvent(machine_id=machine_id, event_type=event_type, details=details,
+                                timestamp=datetime.utcnow())
+        db.add(db_event)
+        db.commit()
+        db.refresh(db_event)
+        return db_event
+
+    def get_by_machine(self, db: Session, machine_id: str, limit: int = 50) -> List[MachineEvent]:
+        return db.query(MachineEvent).filter(
+            MachineEvent.machine_id == machine_id
+        ).order_by(MachineEvent.timestamp.desc(), MachineEvent.id.desc()).limit(limit).all()
+
+    def get_recent(self, db: Session, limit: int = 50) -> List[MachineEvent]:
+        return db.query(MachineEvent).order_by(MachineEvent.timestamp.desc(), MachineEvent.id.desc()).limit(limit).all()
+
+    def get_activity(self, db: Session, limit: int = 10) -> List[dict]:
+        """Recent events joined with hostnames, shaped for the dashboard activity feed"""
+        rows = db.query(MachineEvent, Machine.hostname).outerjoin(
+            Machine, Machine.machine_id == MachineEvent.machine_id
+        ).order_by(MachineEvent.timestamp.desc(), MachineEvent.id.desc()).limit(limit).all()
+        
+        activity = []
+        for event, hostname in rows:
+            name = hostname or event.machine_id
+            if event.event_type == "status":
+                status = (event.details or "").split(" -> ")[-1]
+                message = f"Machine {name} is now {status}"
+            elif event.event_type == "registered":
+                status, message = "online", f"Machine {name} registered"
+            elif event.event_type == "deleted":
+                status, message = "deleted", event.details or f"Machine {name} deleted"
+            else:
+                status, message = event.event_type, f"Machine {name} went {event.event_type}"
+            activity.append({
+                "id": event.id,
+                "machine_id": event.machine_id,
+                "message": message,
+                "status": status,
+                "timestamp": event.timestamp
+            })
+        return activity
+
+# Compliance snapshot CRUD operations
+SNAPSHOT_COUNTERS = [
+    "total_machines", "online_machines", "disk_encrypted", "os_up_to_date",
+    "antivirus_active", "sleep_settings_compliant", "fully_compliant"
+]
+
+def _count_true(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+class ComplianceSnapshotCRUD:
+    def compute_counters(self, db: Session) -> dict:
+        """Current compliance counters per OS plus a fleet-wide "all" entry, in one GROUP BY"""
+        fully_compliant = and_(
+            Machine.disk_encrypted.is_(True),
+            Machine.os_up_to_date.is_(True),
+            Machine.antivirus_active.is_(True),
+            Machine.sleep_settings_compliant.is_(True)
+        )
+        rows = db.query(
+            Machine.operating_system,
+            func.count(Machine.machine_id),
+            _count_true(Machine.is_online.is_(True)),
+            _count_true(Machine.disk_encrypted.is_(True)),
+            _count_true(Machine.os_up_to_date.is_(True)),
+            _count_true(Machine.antivirus_active.is_(True)),
+            _count_true(Machine.sleep_settings_compliant.is_(True)),
+            _count_true(fully_compliant)
+        ).group_by(Machine.operating_system).all()
+        
+        counters = {"all": dict.fromkeys(SNAPSHOT_COUNTERS, 0)}
+        for operating_system, *values in rows:
+            counters[operating_system] = dict(zip(SNAPSHOT_COUNTERS, (int(v) for v in values)))
+            for name, value in counters[operating_system].items():
+                counters["all"][name] += value
+        return counters
+
+    def record(self, db: Session, period: str, period_start: datetime) -> int:
+        """Replace the snapshot rows for one period with the current counters"""
+        counters = self.compute_counters(db)
+        db.query(ComplianceSnapshot).filter(
+            ComplianceSnapshot.period == period,
+            ComplianceSnapshot.period_start == period_start
+        ).delete(synchronize_session=False)
+        db.add_all([
+            ComplianceSnapshot(period=period, period_start=period_start,
+                               operating_system=operating_system, **values)
+            for operating_system, values in counters.items()
+        ])
+        db.commit()
+        return len(counters)
+
+    def get_trend(self, db: Session, period: str = "daily", since: Optional[datetime] = None,
+                  operating_system: str = "all") -> List[ComplianceSnapshot]:
+        query = db.query(ComplianceSnapshot).filter(
+            ComplianceSnapshot.period == period,
+            ComplianceSnapshot.operating_system == operating_system
+        )
+        if since is not None:
+            query = query.filter(ComplianceSnapshot.period_start >= since)
+        return query.order_by(ComplianceSnapshot.period_start).all()
+
+    def prune(self, db: Session, period: str, before: datetime) -> int:
+        deleted = db.query(ComplianceSnapshot).filter(
+            ComplianceSnapshot.period == period,
+            ComplianceSnapshot.period_start < before
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
 
 # User CRUD operations
 class UserCRUD:
@@ -190,4 +708,6 @@ class UserCRUD:
 # Create CRUD instances
 machine_crud = MachineCRUD()
 system_check_crud = SystemCheckCRUD()
+machine_event_crud = MachineEventCRUD()
+compliance_snapshot_crud = ComplianceSnapshotCRUD()
 user_crud = UserCRUD()
@@ -1,19 +1,48 @@
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, event, MetaData
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from fastapi import Request
+import itertools
 import os
+import time
 
-# Database URL - using SQLite for development
-DATABASE_URL = "sqlite:///./solsphere.db"
+from config import settings
+
+DATABASE_URL = settings.database_url
+
+def _create_engine(url: str):
+    if url.startswith("sqlite"):
+        engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False, "timeout": 30},
+            echo=settings.database_echo
+        )
+
+        # WAL lets several worker processes read while one writes
+        @event.listens_for(engine, "connect")
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA busy_timeout=30000")
+            cursor.close()
+
+        return engine
+
+    return create_engine(
+        url,
+        pool_size=settings.database_pool_size,
+        max_overflow=settings.database_max_overflow,
+        pool_pre_ping=True,
+        echo=settings.database_echo
+    )
 
 # Create engine
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
-    echo=True  # Set to False in production
-)
+engine = _create_engine(DATABASE_URL)
+
+# Read-only replicas; reads fall back to the primary when none are configured
+replica_engines = [_create_engine(url) for url in settings.database_replica_urls]
+_next_replica = itertools.cycle(replica_engines)
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -28,3 +57,23 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Cookie set on responses to writes so the same client reads its own writes
+READ_PRIMARY_COOKIE = "solsphere_read_primary"
+
+def wrote_recently(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(READ_PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+# Dependency for read-only endpoints: a replica session unless the client just wrote
+def get_read_db(request: Request):
+    if not replica_engines or wrote_recently(request):
+        yield from get_db()
+        return
+    db = SessionLocal(bind=next(_next_replica))
+    try:
+        yield db
+    finally:
+        db.close()
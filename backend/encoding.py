@@ -0,0 +1,86 @@
+import zlib
+from typing import Any, Callable, Dict
+
+import msgpack
+from fastapi import HTTPException, Request, Response
+from fastapi.routing import APIRoute
+
+from config import settings
+
+def decompress_body(body: bytes, encoding: str, limit: int) -> bytes:
+    """Undo a gzip/deflate Content-Encoding, refusing bodies that inflate past ``limit`` bytes"""
+    if encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        decompressor = zlib.decompressobj()
+    else:
+        raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {encoding}")
+    try:
+        data = decompressor.decompress(body, limit + 1)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Malformed compressed request body")
+    if len(data) > limit:
+        raise HTTPException(status_code=413, detail="Decompressed request body too large")
+    return data
+
+def unpack_msgpack(body: bytes) -> Any:
+    """Decode a MessagePack document into the same plain structure JSON would give"""
+    try:
+        return msgpack.unpackb(body, raw=False)
+    except (ValueError, TypeError, msgpack.UnpackException):
+        raise HTTPException(status_code=400, detail="Malformed MessagePack request body")
+
+# Binary request formats accepted besides JSON, by media type
+BINARY_DECODERS: Dict[str, Callable[[bytes], Any]] = {
+    "application/msgpack": unpack_msgpack,
+    "application/x-msgpack": unpack_msgpack,
+}
+ACCEPT_POST = "application/json, application/msgpack"
+
+def media_type(request: Request) -> str:
+    return request.headers.get("content-type", "").split(";")[0].strip().lower()
+
+class DecodingRequest(Request):
+    """Request whose body is transparently decompressed according to Content-Encoding,
+    and whose binary (MessagePack) payload is decoded in place of JSON"""
+
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            body = await super().body()
+            encoding = self.headers.get("content-encoding", "identity").strip().lower()
+            if encoding != "identity":
+                body = decompress_body(body, encoding, settings.max_request_body_bytes)
+            self._body = body
+        return self._body
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            decoder = BINARY_DECODERS.get(self.scope.get("solsphere.media_type"))
+            if decoder is None:
+                return await super().json()
+            self._json = decoder(await self.body())
+        return self._json
+
+def as_json_scope(scope: dict, binary_type: str) -> dict:
+    """Copy of ``scope`` that FastAPI will parse as a JSON body, remembering the real media type"""
+    headers = [(name, value) for name, value in scope["headers"] if name != b"content-type"]
+    headers.append((b"content-type", b"application/json"))
+    return dict(scope, headers=headers, **{"solsphere.media_type": binary_type})
+
+class DecodingRoute(APIRoute):
+    """Route class that hands endpoints a DecodingRequest, so agents may compress uploads
+    and send MessagePack (advertised to them through Accept-Post)"""
+
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def custom_route_handler(request: Request) -> Response:
+            scope = request.scope
+            binary_type = media_type(request)
+            if binary_type in BINARY_DECODERS:
+                # FastAPI only reads JSON bodies into models; decode the binary format in its place
+                scope = as_json_scope(scope, binary_type)
+            request = DecodingRequest(scope, request.receive)
+            return await original_route_handler(request)
+
+        return custom_route_handler
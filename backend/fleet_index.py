@@ -0,0 +1,243 @@
+"""
+In-memory index of current machine state, one per worker
+
+With ``fleet_index`` enabled, every worker loads a compact record per machine at
+startup, plus secondary indexes by status, operating system and compliance
+flag, and answers machine lists, status counts and compliance totals from
+memory. The database stays the source of truth. Every state-changing write
+stamps its rows with the machines change counter version it bumped, so when
+the counter moves the index fetches just the rows above the version it holds.
+Counter versions commit in order because the counter row is locked until
+commit. Steady-state check-ins skip the counter by design, so their times are
+picked up by a short range scan over ``last_check_in``. Deleted rows leave
+nothing to fetch; a row count that no longer matches triggers a full reload.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from operator import attrgetter
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from models import Machine
+from cache import get_version, watch_counter, MACHINES_COUNTER
+from crud import issue_count_column, MACHINE_STATUSES
+from config import settings
+
+# Compliance check name used by the API -> boolean machine column
+COMPLIANCE_FLAGS = {
+    "disk_encryption": "disk_encrypted",
+    "os_updates": "os_up_to_date",
+    "antivirus": "antivirus_active",
+    "sleep_settings": "sleep_settings_compliant",
+}
+
+# What a record holds; machine list projections within these are served from memory
+INDEXED_FIELDS = [
+    "machine_id", "hostname", "operating_system", "os_version", *COMPLIANCE_FLAGS.values(),
+    "is_online", "status", "last_check_in", "issue_count",
+]
+
+# Check-ins are stamped a moment before they commit, so each scan re-reads this much
+CHECK_IN_OVERLAP = timedelta(seconds=5)
+
+class MachineRecord:
+    __slots__ = INDEXED_FIELDS
+
+    def __init__(self, row):
+        # Rows come from FleetIndex._select, whose columns follow INDEXED_FIELDS
+        for field, value in zip(INDEXED_FIELDS, row):
+            setattr(self, field, value)
+
+def _sort_key(field: str):
+    # NULLs sort after every value, as PostgreSQL orders them
+    return lambda record: (getattr(record, field) is None, getattr(record, field))
+
+class FleetIndex:
+    def __init__(self, poll_seconds: float = None):
+        self.poll_seconds = settings.cache_poll_seconds if poll_seconds is None else poll_seconds
+        self._records: Dict[str, MachineRecord] = {}
+        self._by_status: Dict[str, Set[str]] = {}
+        self._by_os: Dict[str, Set[str]] = {}
+        self._by_flag: Dict[str, Set[str]] = {}
+        self._never_checked_in: Set[str] = set()
+        self._orderings: Dict[tuple, Tuple[int, List[MachineRecord]]] = {}
+        self._generation = 0  # Bumped on every change, invalidates cached orderings
+        self._version = None  # Change counter version the records reflect
+        self._scanned_at: Optional[datetime] = None
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+        watch_counter(MACHINES_COUNTER, self)
+
+    def mark_stale(self) -> None:
+        """Force the next read to sync with the database"""
+        self._checked_at = 0.0
+
+    def _select(self, db: Session):
+        return select(*[
+            issue_count_column(db).label("issue_count") if field == "issue_count" else Machine.__table__.c[field]
+            for field in INDEXED_FIELDS
+        ])
+
+    def _add(self, record: MachineRecord) -> None:
+        machine_id = record.machine_id
+        self._records[machine_id] = record
+        self._by_status.setdefault(record.status, set()).add(machine_id)
+        self._by_os.setdefault(record.operating_system, set()).add(machine_id)
+        for flag in COMPLIANCE_FLAGS.values():
+            if getattr(record, flag):
+                self._by_flag.setdefault(flag, set()).add(machine_id)
+        if record.last_check_in is None:
+            self._never_checked_in.add(machine_id)
+
+    def _remove(self, machine_id: str) -> Optional[MachineRecord]:
+        record = self._records.pop(machine_id, None)
+        if record is not None:
+            for index, key in [(self._by_status, record.status), (self._by_os, record.operating_system)]:
+                index[key].discard(machine_id)
+                if not index[key]:
+                    del index[key]
+            for members in self._by_flag.values():
+                members.discard(machine_id)
+            self._never_checked_in.discard(machine_id)
+        return record
+
+    def load(self, db: Session) -> None:
+        """Replace the whole index with the current contents of ``machines``"""
+        with self._lock:
+            version = get_version(db, MACHINES_COUNTER)
+            scanned_at = datetime.utcnow()
+            rows = db.execute(self._select(db)).all()
+            self._records, self._by_status, self._by_os, self._by_flag = {}, {}, {}, {}
+            self._never_checked_in = set()
+            for row in rows:
+                self._add(MachineRecord(row))
+            self._version = version
+            self._scanned_at = scanned_at
+            self._checked_at = time.monotonic()
+            self._generation += 1
+
+    def sync(self, db: Session) -> None:
+        """Catch up with writes from every worker, at most once per ``poll_seconds``"""
+        with self._lock:
+            if self._version is None:
+                self.load(db)
+                return
+            now = time.monotonic()
+            if now - self._checked_at < self.poll_seconds:
+                return
+            self._checked_at = now
+
+            # A lagging replica may be behind the index; never move backwards
+            version = get_version(db, MACHINES_COUNTER)
+            if version > self._version:
+                rows = db.execute(self._select(db).where(Machine.change_version > self._version)).all()
+                for row in rows:
+                    previous = self._remove(row.machine_id)
+                    record = MachineRecord(row)
+                    if previous is not None and previous.last_check_in is not None and (
+                        record.last_check_in is None or previous.last_check_in > record.last_check_in
+                    ):
+                        record.last_check_in = previous.last_check_in
+                    self._add(record)
+                self._version = version
+                self._generation += 1
+                if db.execute(select(func.count()).select_from(Machine)).scalar() != len(self._records):
+                    # Machines were deleted
+                    self.load(db)
+                    return
+            self._scan_check_ins(db)
+
+    def _scan_check_ins(self, db: Session) -> None:
+        since, self._scanned_at = self._scanned_at - CHECK_IN_OVERLAP, datetime.utcnow()
+        rows = db.execute(
+            select(Machine.machine_id, Machine.last_check_in).where(Machine.last_check_in >= since)
+        )
+        for machine_id, last_check_in in rows:
+            record = self._records.get(machine_id)
+            if record is not None and (record.last_check_in is None or last_check_in > record.last_check_in):
+                record.last_check_in = last_check_in
+                self._never_checked_in.discard(machine_id)
+                self._generation += 1
+
+    def _ordered(self, sort: List[Tuple[str, bool]], records) -> List[MachineRecord]:
+        # Stable sorts from the last key to the first; machine_id first so it breaks ties
+        ordered = sorted(records, key=attrgetter("machine_id"))
+        for field, descending in reversed(sort):
+            ordered.sort(key=_sort_key(field), reverse=descending)
+        return ordered
+
+    def _candidates(self, os_filter: Optional[str], status_filter: Optional[str],
+                    search: Optional[str] = None) -> Optional[Set[str]]:
+        """Machine IDs matching the filters via the secondary indexes; None when unfiltered"""
+        candidates = None
+        if os_filter:
+            needle = os_filter.lower()
+            candidates = set().union(*[ids for name, ids in self._by_os.items() if name and needle in name.lower()])
+        if status_filter == "offline":
+            matches = self._by_status.get("offline", set()) | self._never_checked_in
+            candidates = matches if candidates is None else candidates & matches
+        elif status_filter:
+            matches = self._by_status.get(status_filter, set()) - self._never_checked_in
+            candidates = matches if candidates is None else candidates & matches
+        if search:
+            # No index for substrings; scan the remaining candidates
+            needle = search.lower()
+            candidates = {
+                machine_id for machine_id in (self._records if candidates is None else candidates)
+                if needle in machine_id.lower() or needle in (self._records[machine_id].hostname or "").lower()
+            }
+        return candidates
+
+    def query(
+        self,
+        db: Session,
+        fields: List[str],
+        sort: Optional[List[Tuple[str, bool]]] = None,
+        skip: int = 0,
+        limit: int = 100,
+        os_filter: Optional[str] = None,
+        status_filter: Optional[str] = None,
+        search: Optional[str] = None
+    ) -> List[dict]:
+        """Same rows as ``MachineCRUD.get_projection`` for ``fields`` within INDEXED_FIELDS"""
+        self.sync(db)
+        sort = list(sort or [])
+        with self._lock:
+            candidates = self._candidates(os_filter, status_filter, search)
+            if candidates is None:
+                # Unfiltered lists reuse one ordering per sort until something changes
+                cached = self._orderings.get(tuple(sort))
+                if cached is None or cached[0] != self._generation:
+                    cached = (self._generation, self._ordered(sort, self._records.values()))
+                    self._orderings[tuple(sort)] = cached
+                ordered = cached[1]
+            else:
+                ordered = self._ordered(sort, [self._records[machine_id] for machine_id in candidates])
+            # Page like OFFSET/LIMIT, not like slicing: a negative skip starts at the first row
+            # and a negative limit means no limit (as SQLite reads it)
+            skip = max(skip or 0, 0)
+            page = ordered[skip:] if limit is None or limit < 0 else ordered[skip:skip + limit]
+            return [{field: getattr(record, field) for field in fields} for record in page]
+
+    def count_by_status(self, db: Session) -> dict:
+        """Same result as ``MachineCRUD.count_by_status``"""
+        self.sync(db)
+        with self._lock:
+            counts = dict.fromkeys(MACHINE_STATUSES, 0)
+            for status, ids in self._by_status.items():
+                counts[status] = len(ids)
+            return counts
+
+    def compliance_counts(self, db: Session) -> Tuple[int, Dict[str, int]]:
+        """Total machines and how many pass each compliance check"""
+        self.sync(db)
+        with self._lock:
+            return len(self._records), {
+                check: len(self._by_flag.get(flag, ())) for check, flag in COMPLIANCE_FLAGS.items()
+            }
+
+fleet_index = FleetIndex()
@@ -1,25 +1,54 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-import uvicorn
+from sqlalchemy.orm import Session
 from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import List, Optional
 import os
+import time
 
-from database import engine, Base
+from database import engine, SessionLocal, get_db, get_read_db, replica_engines, READ_PRIMARY_COOKIE
 from models import Machine, SystemCheck
-from schemas import MachineCreate, MachineUpdate, SystemCheckCreate
-from crud import machine_crud, system_check_crud
+from schemas import (
+    MachineBulkUpdate, MachineCreate, MachineFilter, MachineHeartbeat, MachineReport, MachineUpdate,
+    SystemCheckCreate, SystemCheckPage, SystemCheck as SystemCheckSchema
+)
+from crud import machine_crud, system_check_crud, machine_event_crud, compliance_snapshot_crud
+from crud import encode_cursor, decode_cursor, derive_status, MACHINE_FIELDS, SORTABLE_MACHINE_FIELDS
 from auth import get_current_user, create_access_token, authenticate_user
 from config import settings
+from scheduler import offline_detector, snapshot_writer, partition_maintainer, leader
+from cache import ensure_counters, MACHINES_COUNTER, VersionedCache
+from migrations import ensure_schema
+from admission import admission, IngestRejected
+from encoding import DecodingRoute, ACCEPT_POST
+from fleet_index import fleet_index, INDEXED_FIELDS
 
 # Create database tables
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    Base.metadata.create_all(bind=engine)
+    ensure_schema(engine, auto_migrate=settings.auto_migrate)
+    db = SessionLocal()
+    try:
+        ensure_counters(db, MACHINES_COUNTER)
+        if settings.fleet_index:
+            fleet_index.load(db)
+    finally:
+        db.close()
+    offline_detector.start()
+    snapshot_writer.start()
+    partition_maintainer.start()
     yield
     # Shutdown
-    pass
+    await offline_detector.stop()
+    await snapshot_writer.stop()
+    await partition_maintainer.stop()
+    leader.release()
+
+# Dashboard aggregates, shared by all requests in this worker until machines change
+dashboard_cache = VersionedCache(MACHINES_COUNTER)
 
 app = FastAPI(
     title="Solsphere System Utility API",
@@ -27,6 +56,8 @@ app = FastAPI(
     version="1.0.0",
     lifespan=lifespan
 )
+# Request bodies may be gzip/deflate compressed (spooled agent batches are)
+app.router.route_class = DecodingRoute
 
 # CORS middleware
 app.add_middleware(
@@ -37,120 +68,354 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Read-your-writes: after a successful write, pin the client's reads to the primary for a while
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    response = await call_next(request)
+    if replica_engines and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        response.set_cookie(
+            READ_PRIMARY_COOKIE,
+            str(time.time() + settings.read_your_writes_seconds),
+            max_age=int(settings.read_your_writes_seconds) + 1,
+            httponly=True
+        )
+    return response
+
+# Advertise the accepted upload formats on every POST response, errors included, so agents
+# fall back to JSON as soon as a server stops taking MessagePack
+@app.middleware("http")
+async def advertise_upload_formats(request: Request, call_next):
+    response = await call_next(request)
+    if request.method == "POST":
+        response.headers["Accept-Post"] = ACCEPT_POST
+    return response
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "solsphere-api"}
 
+def admit_ingest(machine_id: str, kind: str):
+    """Apply per-machine rate limiting and load shedding to an agent report"""
+    try:
+        admission.admit(machine_id, kind)
+    except IngestRejected as e:
+        retry_after = max(1, int(e.retry_after))
+        raise HTTPException(
+            status_code=e.status_code,
+            detail={"message": e.detail, "next_check_in_after": retry_after,
+                    "jitter_seconds": settings.check_in_jitter_seconds},
+            headers={"Retry-After": str(retry_after)}
+        )
+
 # Machine endpoints
 @app.post("/api/machines", response_model=dict)
-async def create_machine(machine: MachineCreate):
-    """Create a new machine entry"""
+def create_machine(machine: MachineCreate, db: Session = Depends(get_db)):
+    """Create a machine entry or record a check-in for an existing one"""
+    admit_ingest(machine.machine_id, "check-in")
+    try:
+        with admission.track():
+            db_machine = machine_crud.check_in(db, machine)
+        return {
+            "message": "Machine created successfully",
+            "machine_id": db_machine.machine_id,
+            **admission.schedule(db_machine.machine_id)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/machines/batch", response_model=dict)
+def create_machine_batch(reports: List[MachineReport], db: Session = Depends(get_db)):
+    """Replay check-ins an agent spooled while it could not reach the API, oldest first"""
+    if not reports:
+        raise HTTPException(status_code=400, detail="Batch is empty")
+    if len(reports) > settings.max_batch_reports:
+        raise HTTPException(status_code=413, detail=f"At most {settings.max_batch_reports} reports per batch")
+    machine_id = reports[0].machine_id
+    if any(report.machine_id != machine_id for report in reports):
+        raise HTTPException(status_code=400, detail="A batch must contain reports from a single machine")
+    
+    admit_ingest(machine_id, "batch")
+    try:
+        ordered = sorted(reports, key=lambda r: r.collected_at.timestamp() if r.collected_at else float("inf"))
+        with admission.track(len(ordered)):
+            for report in ordered:
+                machine_crud.check_in(db, report)
+        return {
+            "message": "Batch processed successfully",
+            "machine_id": machine_id,
+            "accepted": len(ordered),
+            **admission.schedule(machine_id)
+        }
+    except ValueError as e:
+        # A report the server can never store; the agent drops it
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        # Transient (database errors, lock timeouts): the agent keeps the batch spooled
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/machines/{machine_id}/heartbeat", response_model=dict)
+def machine_heartbeat(machine_id: str, heartbeat: Optional[MachineHeartbeat] = None,
+                      db: Session = Depends(get_db)):
+    """Record a check-in from an agent whose state has not changed since its last report"""
+    admit_ingest(machine_id, "heartbeat")
+    try:
+        summary = heartbeat.metrics_summary if heartbeat else None
+        with admission.track():
+            known = machine_crud.heartbeat(db, machine_id, summary.dict() if summary else None)
+        if not known:
+            raise HTTPException(status_code=404, detail="Machine not found")
+        return {"message": "Heartbeat recorded", "machine_id": machine_id, **admission.schedule(machine_id)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/machines/bulk-update")
+def bulk_update_machines(request: MachineBulkUpdate, db: Session = Depends(get_db)):
+    """Apply the same changes to every machine matching a filter, in bounded batches"""
     try:
-        db_machine = await machine_crud.create(machine)
-        return {"message": "Machine created successfully", "machine_id": db_machine.machine_id}
+        updated = machine_crud.bulk_update(db, request.filter, request.changes)
+        return {"message": "Machines updated successfully", "updated": updated}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/machines/bulk-delete")
+def bulk_delete_machines(machine_filter: MachineFilter, db: Session = Depends(get_db)):
+    """Delete every machine matching a filter, e.g. offline for 90 days, in bounded batches"""
+    try:
+        deleted = machine_crud.bulk_delete(db, machine_filter)
+        return {"message": "Machines deleted successfully", "deleted": deleted}
+    except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _parse_fields(fields: Optional[str], include_issues: bool) -> List[str]:
+    """Requested projection, every column by default; unknown names are a 400"""
+    if fields:
+        requested = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+        unknown = [f for f in requested if f not in MACHINE_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    else:
+        requested = [f for f in MACHINE_FIELDS if f != "issue_count"]
+    if not include_issues:
+        requested = [f for f in requested if f != "issues"]
+    if not requested:
+        raise HTTPException(status_code=400, detail="The requested projection selects no fields")
+    return requested
+
+def _parse_sort(sort: Optional[str]) -> List[tuple]:
+    """``sort=-last_check_in,machine_id`` into (field, descending) pairs"""
+    order = []
+    for item in filter(None, (part.strip() for part in (sort or "").split(","))):
+        field = item.lstrip("+-")
+        if field not in SORTABLE_MACHINE_FIELDS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Cannot sort by {field}; sortable fields: {', '.join(sorted(SORTABLE_MACHINE_FIELDS))}"
+            )
+        order.append((field, item.startswith("-")))
+    return order
 
 @app.get("/api/machines")
-async def get_machines(
-    skip: int = 0,
-    limit: int = 100,
+def get_machines(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
     os_filter: str = None,
-    status_filter: str = None
+    status_filter: str = None,
+    search: Optional[str] = Query(None, description="Substring of the hostname or machine ID"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. machine_id,hostname,issue_count"),
+    sort: Optional[str] = Query(None, description="Comma-separated indexed fields, '-' prefix for descending"),
+    include_issues: bool = True,
+    db: Session = Depends(get_read_db)
 ):
-    """Get all machines with optional filtering"""
+    """Get all machines with optional filtering, projection and sorting"""
+    columns = _parse_fields(fields, include_issues)
+    order = _parse_sort(sort)
     try:
-        machines = await machine_crud.get_multi(skip=skip, limit=limit)
-        
-        # Apply filters
-        if os_filter:
-            machines = [m for m in machines if m.operating_system and os_filter.lower() in m.operating_system.lower()]
-        
-        if status_filter:
-            machines = [m for m in machines if get_machine_status(m) == status_filter]
-        
-        return machines
+        if settings.fleet_index and set(columns) <= set(INDEXED_FIELDS):
+            rows = fleet_index.query(db, columns, order, skip=skip, limit=limit,
+                                     os_filter=os_filter, status_filter=status_filter, search=search)
+        else:
+            rows = machine_crud.get_projection(db, columns, order, skip=skip, limit=limit,
+                                               os_filter=os_filter, status_filter=status_filter,
+                                               search=search)
+        # Rows hold only JSON-ready values and datetimes, so skip FastAPI's generic encoder
+        return JSONResponse(content=[
+            {key: value.isoformat() if isinstance(value, datetime) else value for key, value in row.items()}
+            for row in rows
+        ])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/machines/{machine_id}")
-async def get_machine(machine_id: str):
+def get_machine(machine_id: str, db: Session = Depends(get_read_db)):
     """Get a specific machine by ID"""
     try:
-        machine = await machine_crud.get(machine_id)
+        machine = machine_crud.get(db, machine_id)
         if not machine:
             raise HTTPException(status_code=404, detail="Machine not found")
         return machine
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/api/machines/{machine_id}")
-async def update_machine(machine_id: str, machine_update: MachineUpdate):
+def update_machine(machine_id: str, machine_update: MachineUpdate, db: Session = Depends(get_db)):
     """Update a machine"""
     try:
-        updated_machine = await machine_crud.update(machine_id, machine_update)
+        updated_machine = machine_crud.update(db, machine_id, machine_update)
         if not updated_machine:
             raise HTTPException(status_code=404, detail="Machine not found")
         return updated_machine
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/api/machines/{machine_id}")
-async def delete_machine(machine_id: str):
+def delete_machine(machine_id: str, db: Session = Depends(get_db)):
     """Delete a machine"""
     try:
-        success = await machine_crud.delete(machine_id)
+        success = machine_crud.delete(db, machine_id)
         if not success:
             raise HTTPException(status_code=404, detail="Machine not found")
         return {"message": "Machine deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # System check endpoints
 @app.post("/api/system-checks")
-async def create_system_check(check: SystemCheckCreate):
+def create_system_check(check: SystemCheckCreate, db: Session = Depends(get_db)):
     """Create a new system check entry"""
+    admit_ingest(check.machine_id, "system-check")
     try:
-        db_check = await system_check_crud.create(check)
-        return {"message": "System check created successfully", "check_id": db_check.id}
+        with admission.track():
+            db_check = system_check_crud.create(db, check)
+        return {
+            "message": "System check created successfully",
+            "check_id": db_check.id,
+            **admission.schedule(check.machine_id)
+        }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/api/system-checks/{machine_id}")
-async def get_system_checks(machine_id: str, limit: int = 50):
-    """Get system checks for a specific machine"""
+@app.get("/api/system-checks/{machine_id}", response_model=List[SystemCheckSchema])
+def get_system_checks(
+    machine_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_read_db)
+):
+    """Get system checks for a specific machine, newest first"""
+    try:
+        # Blob-stored details come back resolved, like the history endpoint
+        return system_check_crud.get_by_machine(db, machine_id, limit=limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/system-checks/{machine_id}/history", response_model=SystemCheckPage)
+def get_system_check_history(
+    machine_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    check_type: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Page through a machine's check history, newest first"""
+    return _check_history_page(db, machine_id, limit, cursor, check_type, status, since, until, False)
+
+@app.get("/api/system-checks/{machine_id}/changes", response_model=SystemCheckPage)
+def get_system_check_changes(
+    machine_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    check_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Page through only the checks whose status differs from the previous one of that type"""
+    return _check_history_page(db, machine_id, limit, cursor, check_type, None, since, until, True)
+
+def _check_history_page(db, machine_id, limit, cursor, check_type, status, since, until, changes_only):
+    try:
+        position = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     try:
-        checks = await system_check_crud.get_by_machine(machine_id, limit=limit)
-        return checks
+        checks, has_more = system_check_crud.get_history(
+            db, machine_id, limit=limit, cursor=position, check_type=check_type,
+            status=status, since=since, until=until, changes_only=changes_only
+        )
+        return {
+            "items": checks,
+            "next_cursor": encode_cursor(checks[-1]) if has_more else None
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Machine event endpoints
+@app.get("/api/events")
+def get_recent_events(limit: int = 50, db: Session = Depends(get_read_db)):
+    """Get the most recent online/offline transitions across the fleet"""
+    try:
+        return machine_event_crud.get_recent(db, limit=limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/events/{machine_id}")
+def get_machine_events(machine_id: str, limit: int = 50, db: Session = Depends(get_read_db)):
+    """Get online/offline transitions for a specific machine"""
+    try:
+        return machine_event_crud.get_by_machine(db, machine_id, limit=limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Dashboard endpoints
 @app.get("/api/dashboard/stats")
-async def get_dashboard_stats():
+def get_dashboard_stats(db: Session = Depends(get_read_db)):
     """Get dashboard statistics"""
     try:
-        total_machines = await machine_crud.count()
-        healthy_machines = await machine_crud.count_healthy()
-        warning_machines = await machine_crud.count_warnings()
-        critical_machines = await machine_crud.count_critical()
+        if settings.fleet_index:
+            counts = fleet_index.count_by_status(db)
+        else:
+            counts = dashboard_cache.get(db, "status_counts", machine_crud.count_by_status)
+        total_machines = sum(counts.values())
+        healthy_machines = counts["healthy"]
+        warning_machines = counts["warning"]
+        critical_machines = counts["critical"]
+        offline_machines = counts["offline"]
         
         return {
             "total_machines": total_machines,
             "healthy_machines": healthy_machines,
             "warning_machines": warning_machines,
             "critical_machines": critical_machines,
+            "offline_machines": offline_machines,
             "compliance_rate": round((healthy_machines / total_machines * 100) if total_machines > 0 else 0, 2)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/dashboard/compliance")
-async def get_compliance_overview():
+def get_compliance_overview(db: Session = Depends(get_read_db)):
     """Get compliance overview for all systems"""
     try:
-        machines = await machine_crud.get_multi()
+        if settings.fleet_index:
+            total, compliant = fleet_index.compliance_counts(db)
+            return {check: {"compliant": count, "total": total} for check, count in compliant.items()}
+
+        machines = machine_crud.get_multi(db, limit=None)
         
         compliance_data = {
             "disk_encryption": {"compliant": 0, "total": len(machines)},
@@ -173,12 +438,47 @@ async def get_compliance_overview():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/dashboard/distribution")
+def get_fleet_distribution(db: Session = Depends(get_read_db)):
+    """Get machine counts by OS, OS version and status per OS"""
+    try:
+        return dashboard_cache.get(db, "distribution", machine_crud.get_distribution)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/dashboard/activity")
+def get_recent_activity(limit: int = Query(10, ge=1, le=100), db: Session = Depends(get_read_db)):
+    """Get the recent activity feed built from the machine event log"""
+    try:
+        return dashboard_cache.get(db, ("activity", limit),
+                                   lambda db: machine_event_crud.get_activity(db, limit=limit))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Report endpoints
+@app.get("/api/reports/compliance-trend")
+def get_compliance_trend(
+    days: int = Query(90, ge=1, le=365),
+    period: str = "daily",
+    operating_system: str = "all",
+    db: Session = Depends(get_read_db)
+):
+    """Get precomputed compliance counters over time (one row per period)"""
+    if period not in ("daily", "hourly"):
+        raise HTTPException(status_code=400, detail="period must be 'daily' or 'hourly'")
+    try:
+        since = datetime.utcnow() - timedelta(days=days)
+        return compliance_snapshot_crud.get_trend(db, period=period, since=since,
+                                                  operating_system=operating_system)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Export endpoints
 @app.get("/api/export/machines")
-async def export_machines_csv():
+def export_machines_csv(db: Session = Depends(get_read_db)):
     """Export all machines data as CSV"""
     try:
-        machines = await machine_crud.get_multi()
+        machines = machine_crud.get_multi(db, limit=None)
         
         # Convert to CSV format
         csv_data = "Machine ID,Hostname,OS,Status,Last Check-in,Disk Encrypted,OS Updated,Antivirus Active,Sleep Compliant\n"
@@ -200,22 +500,11 @@ def get_machine_status(machine):
     if not machine.last_check_in:
         return "offline"
     
-    # Check if machine is offline (no check-in for more than 1 hour)
-    from datetime import datetime, timedelta
-    if datetime.utcnow() - machine.last_check_in > timedelta(hours=1):
-        return "offline"
-    
-    # Check for critical issues
-    if machine.issues and any(issue.severity == "critical" for issue in machine.issues):
-        return "critical"
-    
-    # Check for warnings
-    if machine.issues and len(machine.issues) > 0:
-        return "warning"
-    
-    return "healthy"
+    # Status is stored on every write and by the background offline detector
+    return machine.status or derive_status(machine)
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
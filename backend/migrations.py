@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Schema migrations for the Solsphere API
+
+Startup only reads the single-row ``schema_version`` table and compares it to
+the latest migration; tables are reflected and created only when the database
+is actually behind. Run this module directly to migrate ahead of a deploy.
+"""
+
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import Column, Integer, MetaData, Table, bindparam, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from database import engine as default_engine, Base
+import models  # noqa: F401 - registers every table on Base.metadata
+import partitions
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+schema_version_table = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, nullable=False),
+)
+
+# Arbitrary key for the PostgreSQL advisory lock held while migrating
+_MIGRATION_LOCK_ID = 746_551_901
+
+class SchemaOutOfDateError(RuntimeError):
+    pass
+
+def _create_tables(conn: Connection, *names: str) -> None:
+    for name in names:
+        Base.metadata.tables[name].create(conn, checkfirst=True)
+
+def _add_column_if_missing(conn: Connection, table: str, column: str, ddl: str) -> None:
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+def _create_index_if_missing(conn: Connection, table: str, index: str) -> None:
+    existing = {i["name"] for i in inspect(conn).get_indexes(table)}
+    if index not in existing:
+        for idx in Base.metadata.tables[table].indexes:
+            if idx.name == index:
+                idx.create(conn)
+
+def _initial_schema(conn: Connection) -> None:
+    _create_tables(conn, "machines", "system_checks", "users")
+
+def _offline_tracking(conn: Connection) -> None:
+    _add_column_if_missing(conn, "machines", "is_online", "BOOLEAN DEFAULT TRUE")
+    _create_index_if_missing(conn, "machines", "ix_machines_is_online")
+    _create_index_if_missing(conn, "machines", "ix_machines_last_check_in")
+    _create_tables(conn, "machine_events", "change_counters")
+
+def _compliance_snapshots(conn: Connection) -> None:
+    _create_tables(conn, "compliance_snapshots")
+
+def _partition_system_checks(conn: Connection) -> None:
+    partitions.convert_to_partitioned(conn)
+
+def _check_history_indexes(conn: Connection) -> None:
+    partitions.add_column(conn, "status_changed", "BOOLEAN NOT NULL DEFAULT TRUE")
+    partitions.create_index(conn, "machine_type_ts", ("machine_id", "check_type", "timestamp"))
+    partitions.create_index(conn, "machine_changes_ts", ("machine_id", "status_changed", "timestamp"))
+
+    # Backfill: a row is a change point unless it repeats the previous status of its type
+    repeated = conn.execute(text(
+        "SELECT id FROM ("
+        "SELECT id, status, LAG(status) OVER ("
+        "PARTITION BY machine_id, check_type ORDER BY timestamp, id) AS previous_status "
+        "FROM system_checks) AS history WHERE previous_status = status"
+    )).scalars().all()
+    for table in partitions.writable_tables(conn):
+        for start in range(0, len(repeated), 500):
+            conn.execute(
+                text(f"UPDATE {table} SET status_changed = FALSE WHERE id IN :ids")
+                .bindparams(bindparam("ids", expanding=True)),
+                {"ids": repeated[start:start + 500]}
+            )
+
+def _machine_status(conn: Connection) -> None:
+    from crud import derive_status
+
+    _add_column_if_missing(conn, "machines", "status", "VARCHAR DEFAULT 'healthy'")
+    _create_index_if_missing(conn, "machines", "ix_machines_status")
+    _create_index_if_missing(conn, "machines", "ix_machines_os_status")
+
+    machines = Base.metadata.tables["machines"]
+    rows = conn.execute(select(machines.c.machine_id, machines.c.is_online, machines.c.issues)).all()
+    for row in rows:
+        conn.execute(
+            machines.update().where(machines.c.machine_id == row.machine_id).values(status=derive_status(row))
+        )
+
+def _metrics_summary(conn: Connection) -> None:
+    _add_column_if_missing(conn, "machines", "metrics_summary", "JSON")
+
+def _detail_blobs(conn: Connection) -> None:
+    import blobs
+
+    _create_tables(conn, "check_detail_blobs")
+    partitions.add_column(conn, "details_digest", "VARCHAR(64)")
+
+    # Move existing large details into blobs, a batch of rows at a time. The threshold is
+    # in UTF-8 bytes like blobs.should_store, while length() counts characters
+    byte_length = "octet_length(details)" if conn.dialect.name == "postgresql" else "length(CAST(details AS BLOB))"
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, details FROM system_checks "
+            f"WHERE id > :last_id AND details IS NOT NULL AND {byte_length} >= :min_length "
+            "ORDER BY id LIMIT 500"
+        ), {"last_id": last_id, "min_length": settings.detail_blob_min_bytes}).all()
+        if not rows:
+            break
+        moved = [{"digest": blobs.store(conn, row.details), "id": row.id} for row in rows]
+        for table in partitions.writable_tables(conn):
+            conn.execute(text(f"UPDATE {table} SET details = NULL, details_digest = :digest WHERE id = :id"), moved)
+        last_id = rows[-1].id
+
+def _change_versions(conn: Connection) -> None:
+    _add_column_if_missing(conn, "machines", "change_version", "INTEGER NOT NULL DEFAULT 0")
+    _create_index_if_missing(conn, "machines", "ix_machines_change_version")
+
+# Append new migrations to the end; never reorder or edit released ones
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "initial schema", _initial_schema),
+    (2, "offline tracking and change counters", _offline_tracking),
+    (3, "compliance snapshots", _compliance_snapshots),
+    (4, "monthly partitions for system_checks", _partition_system_checks),
+    (5, "check history indexes and status change points", _check_history_indexes),
+    (6, "stored machine status for fleet aggregates", _machine_status),
+    (7, "agent metric summaries", _metrics_summary),
+    (8, "content-addressed check detail blobs", _detail_blobs),
+    (9, "per-row change versions for the fleet index", _change_versions),
+]
+
+HEAD = MIGRATIONS[-1][0]
+
+def get_schema_version(conn: Connection) -> int:
+    try:
+        return conn.execute(select(schema_version_table.c.version)).scalar() or 0
+    except Exception:
+        # Table does not exist yet
+        conn.rollback()
+        return 0
+
+def _set_schema_version(conn: Connection, version: int) -> None:
+    conn.execute(schema_version_table.delete())
+    conn.execute(schema_version_table.insert().values(version=version))
+
+def migrate(engine: Engine = None) -> int:
+    """Apply pending migrations and return the resulting schema version"""
+    engine = engine or default_engine
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": _MIGRATION_LOCK_ID})
+        elif conn.dialect.name == "sqlite":
+            # Take the write lock up front so concurrent workers migrate one at a time
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+        schema_version_table.create(conn, checkfirst=True)
+        current = get_schema_version(conn)
+        for version, description, apply in MIGRATIONS:
+            if version > current:
+                logger.info(f"Applying migration {version}: {description}")
+                apply(conn)
+                current = version
+        _set_schema_version(conn, current)
+    return current
+
+def ensure_schema(engine: Engine = None, auto_migrate: bool = True) -> int:
+    """Cheap startup check: one SELECT when the schema is already current"""
+    engine = engine or default_engine
+    with engine.connect() as conn:
+        current = get_schema_version(conn)
+    if current >= HEAD:
+        return current
+    if not auto_migrate:
+        raise SchemaOutOfDateError(
+            f"Database schema is at version {current}, expected {HEAD}; run migrations.py"
+        )
+    return migrate(engine)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"Schema at version {migrate()}")
@@ -1,10 +1,13 @@
-from sqlalchemy import Column, String, Boolean, DateTime, Integer, Text, JSON
-from sqlalchemy.sql import func
+from sqlalchemy import Column, String, Boolean, DateTime, Integer, Text, JSON, Index, LargeBinary
+from sqlalchemy.sql import func, true
 from database import Base
 from datetime import datetime
 
 class Machine(Base):
     __tablename__ = "machines"
+    __table_args__ = (
+        Index("ix_machines_os_status", "operating_system", "status"),
+    )
 
     machine_id = Column(String, primary_key=True, index=True)
     hostname = Column(String, nullable=False)
@@ -14,15 +17,19 @@ class Machine(Base):
     os_up_to_date = Column(Boolean, default=False)
     antivirus_active = Column(Boolean, default=False)
     sleep_settings_compliant = Column(Boolean, default=False)
-    last_check_in = Column(DateTime, default=func.now())
+    last_check_in = Column(DateTime, default=func.now(), index=True)
+    is_online = Column(Boolean, default=True, index=True)  # Maintained by the offline detector
+    status = Column(String, default="healthy", index=True)  # "healthy", "warning", "critical", "offline"
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    change_version = Column(Integer, nullable=False, default=0, server_default="0", index=True)  # Machines counter version of the last state change, see fleet_index.py
     
     # Additional fields for system health
     cpu_usage = Column(Integer)  # Percentage
     memory_usage = Column(Integer)  # Percentage
     disk_usage = Column(Integer)  # Percentage
     network_status = Column(String)  # "connected", "disconnected"
+    metrics_summary = Column(JSON)  # min/avg/max/p95 per metric since the agent's previous report
     
     # Issues as JSON field
     issues = Column(JSON, default=list)
@@ -31,18 +38,82 @@ class Machine(Base):
         return f"<Machine(machine_id='{self.machine_id}', hostname='{self.hostname}')>"
 
 class SystemCheck(Base):
+    # Partitioned by month on PostgreSQL/SQLite, see partitions.py
     __tablename__ = "system_checks"
+    __table_args__ = (
+        Index("ix_system_checks_machine_ts", "machine_id", "timestamp"),
+        Index("ix_system_checks_machine_type_ts", "machine_id", "check_type", "timestamp"),
+        Index("ix_system_checks_machine_changes_ts", "machine_id", "status_changed", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     machine_id = Column(String, nullable=False, index=True)
     check_type = Column(String, nullable=False)  # "health", "compliance", "security"
     status = Column(String, nullable=False)  # "pass", "fail", "warning"
-    details = Column(Text)
-    timestamp = Column(DateTime, default=func.now())
+    status_changed = Column(Boolean, nullable=False, default=True, server_default=true())  # Differs from the previous check of this type
+    details = Column(Text)  # Inline when small, otherwise None and stored in check_detail_blobs
+    details_digest = Column(String(64))  # SHA-256 of large details, see blobs.py
+    timestamp = Column(DateTime, default=func.now(), nullable=False, index=True)
     
     def __repr__(self):
         return f"<SystemCheck(id={self.id}, machine_id='{self.machine_id}', type='{self.check_type}')>"
 
+class CheckDetailBlob(Base):
+    # Content-addressed: identical details from any number of checks share one row
+    __tablename__ = "check_detail_blobs"
+
+    digest = Column(String(64), primary_key=True)  # SHA-256 of the uncompressed text
+    data = Column(LargeBinary, nullable=False)  # zstd-compressed UTF-8
+    size = Column(Integer, nullable=False)  # Uncompressed bytes
+    created_at = Column(DateTime, default=func.now())
+
+    def __repr__(self):
+        return f"<CheckDetailBlob(digest='{self.digest}', size={self.size})>"
+
+class MachineEvent(Base):
+    __tablename__ = "machine_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    machine_id = Column(String, nullable=False, index=True)
+    event_type = Column(String, nullable=False)  # "registered", "online", "offline", "status", "deleted"
+    details = Column(Text)
+    timestamp = Column(DateTime, default=func.now(), index=True)
+
+    def __repr__(self):
+        return f"<MachineEvent(id={self.id}, machine_id='{self.machine_id}', type='{self.event_type}')>"
+
+class ChangeCounter(Base):
+    __tablename__ = "change_counters"
+
+    name = Column(String, primary_key=True)  # e.g. "machines"
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<ChangeCounter(name='{self.name}', version={self.version})>"
+
+class ComplianceSnapshot(Base):
+    __tablename__ = "compliance_snapshots"
+    __table_args__ = (
+        Index("ix_compliance_snapshots_lookup", "period", "operating_system", "period_start", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    period = Column(String, nullable=False)  # "daily", "hourly"
+    period_start = Column(DateTime, nullable=False)
+    operating_system = Column(String, nullable=False, default="all")  # "all" = fleet-wide
+    total_machines = Column(Integer, nullable=False, default=0)
+    online_machines = Column(Integer, nullable=False, default=0)
+    disk_encrypted = Column(Integer, nullable=False, default=0)
+    os_up_to_date = Column(Integer, nullable=False, default=0)
+    antivirus_active = Column(Integer, nullable=False, default=0)
+    sleep_settings_compliant = Column(Integer, nullable=False, default=0)
+    fully_compliant = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<ComplianceSnapshot(period='{self.period}', period_start='{self.period_start}', os='{self.operating_system}')>"
+
 class User(Base):
     __tablename__ = "users"
 
@@ -0,0 +1,314 @@
+"""
+Monthly time partitioning for the system_checks history
+
+PostgreSQL uses native declarative partitions: ``system_checks`` is a
+``PARTITION BY RANGE (timestamp)`` parent with one child table per month, so
+inserts through the ORM are routed by the server and bounded queries are pruned
+by the planner.
+
+SQLite has no partitioning, so each month is a physical ``system_checks_yYYYYmMM``
+table and ``system_checks`` becomes a read-only ``UNION ALL`` view over them.
+Writes go straight to the month's table and reads address only the months they
+need. IDs stay unique across months by drawing them from a one-row sequence
+table inside the inserting transaction.
+
+In both cases retention is a ``DROP TABLE`` of whole months rather than a
+large ``DELETE``. Other dialects keep a single unpartitioned table.
+"""
+
+import re
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import (
+    Column, Index, Integer, MetaData, Table, func, insert, inspect, literal_column, select, text, update
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import aliased
+
+from models import SystemCheck
+
+PARENT = "system_checks"
+_NAME_PATTERN = re.compile(r"^system_checks_y(\d{4})m(\d{2})$")
+
+# Physical SQLite partition tables, built from the SystemCheck columns on demand
+_sqlite_metadata = MetaData()
+
+# Indexes every SQLite month partition carries, as (name suffix, columns)
+PARTITION_INDEXES = [
+    ("machine_ts", ("machine_id", "timestamp")),
+    ("ts", ("timestamp",)),
+    ("machine_type_ts", ("machine_id", "check_type", "timestamp")),
+    ("machine_changes_ts", ("machine_id", "status_changed", "timestamp")),
+]
+
+# SQLite serializes writers, so a single counter row is a cheap shared sequence
+id_sequence = Table(
+    "system_checks_id_seq", _sqlite_metadata,
+    Column("value", Integer, nullable=False),
+)
+
+def month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(month: datetime) -> datetime:
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+def partition_name(month: datetime) -> str:
+    return f"{PARENT}_y{month.year:04d}m{month.month:02d}"
+
+def dialect_of(conn: Connection) -> Optional[str]:
+    """Return "postgresql" or "sqlite" when partitioning is supported, else None"""
+    name = conn.dialect.name
+    return name if name in ("postgresql", "sqlite") else None
+
+def partition_table(month: datetime) -> Table:
+    """SQLAlchemy Table for a SQLite month partition"""
+    name = partition_name(month)
+    if name in _sqlite_metadata.tables:
+        return _sqlite_metadata.tables[name]
+    columns = [
+        Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable,
+               server_default=c.server_default.arg if c.server_default is not None else None)
+        for c in SystemCheck.__table__.columns
+    ]
+    indexes = [Index(f"ix_{name}_{suffix}", *cols) for suffix, cols in PARTITION_INDEXES]
+    return Table(name, _sqlite_metadata, *columns, *indexes)
+
+def list_partitions(conn: Connection) -> List[datetime]:
+    """Existing month partitions, oldest first"""
+    dialect = dialect_of(conn)
+    if dialect == "postgresql":
+        names = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :parent"
+        ), {"parent": PARENT}).scalars().all()
+    elif dialect == "sqlite":
+        names = conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'system\\_checks\\_y%' ESCAPE '\\'"
+        )).scalars().all()
+    else:
+        return []
+
+    months = []
+    for name in names:
+        match = _NAME_PATTERN.match(name)
+        if match:
+            months.append(datetime(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+def is_partitioned(conn: Connection) -> bool:
+    dialect = dialect_of(conn)
+    if dialect == "postgresql":
+        return bool(conn.execute(text(
+            "SELECT 1 FROM pg_class WHERE relname = :parent AND relkind = 'p'"
+        ), {"parent": PARENT}).scalar())
+    if dialect == "sqlite":
+        return bool(conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = :parent"
+        ), {"parent": PARENT}).scalar())
+    return False
+
+def _rebuild_sqlite_view(conn: Connection, months: List[datetime]) -> None:
+    columns = ", ".join(f'"{c.name}"' for c in SystemCheck.__table__.columns)
+    selects = " UNION ALL ".join(f"SELECT {columns} FROM {partition_name(m)}" for m in months)
+    conn.execute(text(f"DROP VIEW IF EXISTS {PARENT}"))
+    conn.execute(text(f"CREATE VIEW {PARENT} AS {selects}"))
+
+def ensure_partition(conn: Connection, month: datetime) -> None:
+    """Create the partition holding ``month`` if it does not exist yet"""
+    month = month_start(month)
+    dialect = dialect_of(conn)
+    if dialect == "postgresql":
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {PARENT} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+        ))
+    elif dialect == "sqlite":
+        existing = list_partitions(conn)
+        if month in existing:
+            return
+        partition_table(month).create(conn, checkfirst=True)
+        _rebuild_sqlite_view(conn, sorted(existing + [month]))
+
+def drop_partitions_before(conn: Connection, cutoff: datetime) -> List[str]:
+    """Drop every month partition that ends on or before ``cutoff``"""
+    months = list_partitions(conn)
+    expired = [m for m in months if next_month(m) <= cutoff]
+    if dialect_of(conn) == "sqlite":
+        # The view must always cover at least one table
+        kept = [m for m in months if m not in expired]
+        if not kept:
+            ensure_partition(conn, cutoff)
+            kept = [month_start(cutoff)]
+        _rebuild_sqlite_view(conn, kept)
+    for month in expired:
+        conn.execute(text(f"DROP TABLE {partition_name(month)}"))
+        _known_months.discard(month)
+    return [partition_name(m) for m in expired]
+
+def add_column(conn: Connection, column: str, ddl: str) -> None:
+    """Add a column to system_checks, including every existing partition"""
+    if dialect_of(conn) == "sqlite" and is_partitioned(conn):
+        months = list_partitions(conn)
+        for month in months:
+            name = partition_name(month)
+            existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({name})"))}
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {name} ADD COLUMN {column} {ddl}"))
+        _rebuild_sqlite_view(conn, months)
+    elif dialect_of(conn) == "postgresql":
+        # Partitions inherit columns from the parent
+        conn.execute(text(f"ALTER TABLE {PARENT} ADD COLUMN IF NOT EXISTS {column} {ddl}"))
+    else:
+        existing = {c["name"] for c in inspect(conn).get_columns(PARENT)}
+        if column not in existing:
+            conn.execute(text(f"ALTER TABLE {PARENT} ADD COLUMN {column} {ddl}"))
+
+def create_index(conn: Connection, suffix: str, columns: tuple) -> None:
+    """Create an index on system_checks, including every existing partition"""
+    column_list = ", ".join(columns)
+    if dialect_of(conn) == "sqlite" and is_partitioned(conn):
+        for month in list_partitions(conn):
+            name = partition_name(month)
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{name}_{suffix} ON {name} ({column_list})"))
+    else:
+        # PostgreSQL cascades an index on the parent to every partition
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{PARENT}_{suffix} ON {PARENT} ({column_list})"))
+
+def writable_tables(conn: Connection) -> List[str]:
+    """Tables that accept UPDATEs for system_checks rows (the SQLite view does not)"""
+    if dialect_of(conn) == "sqlite" and is_partitioned(conn):
+        return [partition_name(m) for m in list_partitions(conn)]
+    return [PARENT]
+
+def months_in_range(conn: Connection, since: Optional[datetime] = None,
+                    until: Optional[datetime] = None) -> List[Optional[datetime]]:
+    """Partitions overlapping [since, until), newest first.
+
+    Returns ``[None]`` when the table is not partitioned, meaning "query the
+    whole table".
+    """
+    if not is_partitioned(conn):
+        return [None]
+    months = list_partitions(conn)
+    if since is not None:
+        months = [m for m in months if next_month(m) > since]
+    if until is not None:
+        months = [m for m in months if m < until]
+    return list(reversed(months))
+
+def entity_for(conn: Connection, month: Optional[datetime]):
+    """ORM entity to query for one partition (an alias of SystemCheck on SQLite)"""
+    if month is not None and dialect_of(conn) == "sqlite":
+        return aliased(SystemCheck, partition_table(month), adapt_on_names=True)
+    return SystemCheck
+
+# Months this process has already created or seen, to skip the catalog lookup on insert
+_known_months = set()
+
+def insert_check(conn: Connection, values: dict) -> int:
+    """Insert one row into its SQLite month partition and return its id"""
+    month = month_start(values["timestamp"])
+    if month not in _known_months:
+        ensure_partition(conn, month)
+        _known_months.add(month)
+    check_id = conn.execute(
+        update(id_sequence).values(value=id_sequence.c.value + 1).returning(id_sequence.c.value)
+    ).scalar_one()
+    conn.execute(insert(partition_table(month)).values(id=check_id, **values))
+    return check_id
+
+def _convert_postgresql(conn: Connection, now: datetime) -> None:
+    conn.execute(text(f"ALTER TABLE {PARENT} RENAME TO {PARENT}_unpartitioned"))
+    conn.execute(text(
+        f"ALTER TABLE {PARENT}_unpartitioned RENAME CONSTRAINT {PARENT}_pkey TO {PARENT}_unpartitioned_pkey"
+    ))
+    for index in ("ix_system_checks_id", "ix_system_checks_machine_id", "ix_system_checks_machine_ts",
+                  "ix_system_checks_timestamp"):
+        conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+    conn.execute(text("CREATE SEQUENCE IF NOT EXISTS system_checks_part_id_seq"))
+    conn.execute(text(
+        f"CREATE TABLE {PARENT} ("
+        "id INTEGER NOT NULL DEFAULT nextval('system_checks_part_id_seq'), "
+        "machine_id VARCHAR NOT NULL, "
+        "check_type VARCHAR NOT NULL, "
+        "status VARCHAR NOT NULL, "
+        "details TEXT, "
+        "timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(), "
+        "PRIMARY KEY (id, timestamp)"
+        ") PARTITION BY RANGE (timestamp)"
+    ))
+    conn.execute(text(f"CREATE INDEX ix_system_checks_machine_ts ON {PARENT} (machine_id, timestamp)"))
+    conn.execute(text(f"CREATE INDEX ix_system_checks_timestamp ON {PARENT} (timestamp)"))
+
+    old_months = conn.execute(text(
+        f"SELECT DISTINCT date_trunc('month', timestamp) FROM {PARENT}_unpartitioned "
+        "WHERE timestamp IS NOT NULL"
+    )).scalars().all()
+    for month in set(old_months) | {month_start(now), next_month(month_start(now))}:
+        ensure_partition(conn, month)
+
+    conn.execute(text(
+        f"INSERT INTO {PARENT} (id, machine_id, check_type, status, details, timestamp) "
+        f"SELECT id, machine_id, check_type, status, details, COALESCE(timestamp, now()) "
+        f"FROM {PARENT}_unpartitioned"
+    ))
+    conn.execute(text(
+        f"SELECT setval('system_checks_part_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM {PARENT}), false)"
+    ))
+    conn.execute(text(f"DROP TABLE {PARENT}_unpartitioned"))
+
+def _sqlite_datetime(value: datetime) -> str:
+    """Format a datetime the way SQLAlchemy stores it in SQLite"""
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+def _convert_sqlite(conn: Connection, now: datetime) -> None:
+    old = Table(PARENT, MetaData(), autoload_with=conn)
+    old_months = conn.execute(text(
+        f"SELECT DISTINCT substr(timestamp, 1, 7) FROM {PARENT} WHERE timestamp IS NOT NULL"
+    )).scalars().all()
+    months = {datetime.strptime(m, "%Y-%m") for m in old_months}
+    months |= {month_start(now), next_month(month_start(now))}
+    months = sorted(months)
+
+    # Rows written by CURRENT_TIMESTAMP lack the microseconds SQLAlchemy writes, which
+    # would break string comparison of keyset cursors, so normalize while copying
+    normalized = literal_column(
+        "CASE WHEN length(timestamp) = 19 THEN timestamp || '.000000' ELSE timestamp END"
+    )
+    timestamp = func.coalesce(normalized, _sqlite_datetime(now))
+    # Older databases may predate some SystemCheck columns; later migrations add them
+    copied = [c.name for c in partition_table(months[0]).columns if c.name in old.c]
+    for month in months:
+        table = partition_table(month)
+        table.create(conn, checkfirst=True)
+        bounds = (normalized >= _sqlite_datetime(month)) & (normalized < _sqlite_datetime(next_month(month)))
+        if month == month_start(now):
+            bounds = bounds | old.c.timestamp.is_(None)
+        conn.execute(insert(table).from_select(
+            copied,
+            select(*[
+                timestamp if name == "timestamp" else old.c[name]
+                for name in copied
+            ]).where(bounds)
+        ))
+
+    id_sequence.create(conn, checkfirst=True)
+    conn.execute(insert(id_sequence).values(value=conn.execute(select(func.max(old.c.id))).scalar() or 0))
+    conn.execute(text(f"DROP TABLE {PARENT}"))
+    _rebuild_sqlite_view(conn, months)
+
+def convert_to_partitioned(conn: Connection) -> None:
+    """Migrate an existing single system_checks table to monthly partitions"""
+    if dialect_of(conn) is None or is_partitioned(conn):
+        return
+    now = datetime.utcnow()
+    if dialect_of(conn) == "postgresql":
+        _convert_postgresql(conn, now)
+    else:
+        _convert_sqlite(conn, now)
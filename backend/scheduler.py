@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal, engine
+import partitions
+import blobs
+from crud import machine_crud, compliance_snapshot_crud
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for the PostgreSQL advisory lock held by the leader worker
+_LEADER_LOCK_ID = 746_551_902
+
+class LeaderLock:
+    """Elects one worker process to run the background tasks.
+
+    serve.py starts several workers, and each would otherwise scan, snapshot and
+    run partition DDL on its own. On PostgreSQL the leader holds a session-level
+    advisory lock on a dedicated connection; on SQLite, where every worker shares
+    one host, an exclusive ``flock`` on a file next to the database. Either is
+    released when the process dies, and the next worker to try takes over.
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self._conn: Optional[Connection] = None
+        self._file = None
+        self._unshared = False  # No lock to take here, so this process just runs the tasks
+        self._lock = threading.Lock()
+
+    def _lock_path(self) -> Optional[str]:
+        database = self.engine.url.database
+        if not database or database == ":memory:":
+            return None
+        return f"{database}.leader"
+
+    def _still_held(self) -> bool:
+        if self._conn is None:
+            return self._file is not None or self._unshared
+        try:
+            self._conn.execute(text("SELECT 1"))
+            # End the probe's transaction; the session-level lock survives it, and an
+            # idle-in-transaction connection would hold back vacuum
+            self._conn.rollback()
+            return True
+        except Exception:
+            # Connection lost, and the advisory lock with it
+            self.release()
+            return False
+
+    def acquire(self) -> bool:
+        """True if this process is (or just became) the leader; never blocks on other workers"""
+        with self._lock:
+            if self._still_held():
+                return True
+            dialect = self.engine.dialect.name
+            if dialect == "postgresql":
+                conn = self.engine.connect()
+                if conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": _LEADER_LOCK_ID}).scalar():
+                    conn.commit()
+                    self._conn = conn
+                    return True
+                conn.close()
+                return False
+            if dialect == "sqlite":
+                path = self._lock_path()
+                try:
+                    import fcntl
+                except ImportError:
+                    # No flock (Windows): a single worker is the only supported setup there
+                    path = None
+                if path is None:
+                    self._unshared = True
+                    return True
+                lock_file = open(path, "a")
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    return False
+                self._file = lock_file
+                return True
+            # Other databases have no lock to share; every worker runs the tasks
+            self._unshared = True
+            return True
+
+    def release(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._unshared = False
+
+leader = LeaderLock(engine)
+
+class PeriodicTask:
+    """Runs ``run_once`` in a worker thread every ``interval_seconds`` while the app is up"""
+
+    name = "periodic task"
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def run_once(self):
+        raise NotImplementedError
+
+    async def _run(self):
+        while True:
+            try:
+                # Only the leader worker runs background tasks; the rest keep asking
+                if await asyncio.to_thread(leader.acquire):
+                    await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.error(f"{self.name} failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+class OfflineDetector(PeriodicTask):
+    """Background task that marks machines offline once their check-in deadline passes.
+
+    Each scan walks the ``last_check_in`` index for online machines older than the
+    threshold, persists ``is_online = False`` and records an "offline" event, so
+    detection latency is bounded by the scan interval.
+    """
+
+    name = "Offline detection scan"
+
+    def __init__(self, interval_seconds: int = None, threshold_minutes: int = None, batch_size: int = 500):
+        super().__init__(interval_seconds or settings.offline_scan_interval_seconds)
+        self.threshold_minutes = threshold_minutes or settings.offline_threshold_minutes
+        self.batch_size = batch_size
+
+    def run_once(self) -> List[str]:
+        """Run a single scan and return the IDs of machines that went offline"""
+        cutoff_time = datetime.utcnow() - timedelta(minutes=self.threshold_minutes)
+        transitioned = []
+        db = SessionLocal()
+        try:
+            while True:
+                machine_ids = machine_crud.mark_offline(db, cutoff_time, batch_size=self.batch_size)
+                transitioned.extend(machine_ids)
+                if len(machine_ids) < self.batch_size:
+                    break
+        finally:
+            db.close()
+
+        for machine_id in transitioned:
+            logger.info(f"Machine {machine_id} went offline")
+        return transitioned
+
+class SnapshotWriter(PeriodicTask):
+    """Keeps the current day's (and hour's) compliance snapshot rows up to date.
+
+    Rows are rewritten on every run, so once a period ends its row holds the
+    counters as of the last run inside that period.
+    """
+
+    name = "Compliance snapshot"
+
+    def __init__(self, interval_minutes: int = None, hourly: bool = None):
+        super().__init__((interval_minutes or settings.snapshot_interval_minutes) * 60)
+        self.hourly = settings.hourly_snapshots if hourly is None else hourly
+
+    def run_once(self):
+        now = datetime.utcnow()
+        periods = [("daily", now.replace(hour=0, minute=0, second=0, microsecond=0))]
+        if self.hourly:
+            periods.append(("hourly", now.replace(minute=0, second=0, microsecond=0)))
+
+        db = SessionLocal()
+        try:
+            for period, period_start in periods:
+                try:
+                    compliance_snapshot_crud.record(db, period, period_start)
+                except IntegrityError:
+                    # Another worker wrote the same period concurrently
+                    db.rollback()
+            if self.hourly:
+                retention = now - timedelta(days=settings.hourly_snapshot_retention_days)
+                compliance_snapshot_crud.prune(db, "hourly", retention)
+        finally:
+            db.close()
+
+class PartitionMaintainer(PeriodicTask):
+    """Creates next month's system_checks partition ahead of time, drops expired months
+    and the detail blobs only they referenced"""
+
+    name = "Partition maintenance"
+
+    def __init__(self, interval_seconds: int = 3600, retention_months: int = None):
+        super().__init__(interval_seconds)
+        self.retention_months = settings.check_retention_months if retention_months is None else retention_months
+
+    def run_once(self) -> List[str]:
+        with engine.begin() as conn:
+            if not partitions.is_partitioned(conn):
+                return []
+            current = partitions.month_start(datetime.utcnow())
+            partitions.ensure_partition(conn, current)
+            partitions.ensure_partition(conn, partitions.next_month(current))
+
+            if not self.retention_months:
+                return []
+            cutoff = current
+            for _ in range(self.retention_months - 1):
+                cutoff = (cutoff - timedelta(days=1)).replace(day=1)
+            dropped = partitions.drop_partitions_before(conn, cutoff)
+            # Blobs only lose their last reference when whole months go
+            removed = blobs.collect_garbage(conn) if dropped else 0
+
+        for name in dropped:
+            logger.info(f"Dropped expired partition {name}")
+        if removed:
+            logger.info(f"Removed {removed} unreferenced check detail blobs")
+        return dropped
+
+offline_detector = OfflineDetector()
+snapshot_writer = SnapshotWriter()
+partition_maintainer = PartitionMaintainer()
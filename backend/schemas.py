@@ -2,6 +2,22 @@ from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 
+# Metric summaries sampled by the agent between reports
+class MetricSummary(BaseModel):
+    min: float
+    avg: float
+    max: float
+    p95: float
+    samples: int = Field(..., ge=1)
+
+class MetricsSummary(BaseModel):
+    cpu: Optional[MetricSummary] = None
+    memory: Optional[MetricSummary] = None
+    disk: Optional[MetricSummary] = None
+    net_sent_bytes_per_sec: Optional[MetricSummary] = None
+    net_recv_bytes_per_sec: Optional[MetricSummary] = None
+    window_seconds: Optional[float] = Field(None, description="Time covered by the samples")
+
 # Machine schemas
 class MachineBase(BaseModel):
     hostname: str = Field(..., description="Machine hostname")
@@ -14,6 +30,18 @@ class MachineBase(BaseModel):
 
 class MachineCreate(MachineBase):
     machine_id: str = Field(..., description="Unique machine identifier")
+    cpu_usage: Optional[int] = Field(None, ge=0, le=100)
+    memory_usage: Optional[int] = Field(None, ge=0, le=100)
+    disk_usage: Optional[int] = Field(None, ge=0, le=100)
+    network_status: Optional[str] = None
+    metrics_summary: Optional[MetricsSummary] = None
+    issues: Optional[List[Dict[str, Any]]] = None
+
+class MachineReport(MachineCreate):
+    collected_at: Optional[datetime] = Field(None, description="When the agent collected this report")
+
+class MachineHeartbeat(BaseModel):
+    metrics_summary: Optional[MetricsSummary] = None
 
 class MachineUpdate(BaseModel):
     hostname: Optional[str] = None
@@ -29,14 +57,30 @@ class MachineUpdate(BaseModel):
     network_status: Optional[str] = None
     issues: Optional[List[Dict[str, Any]]] = None
 
+class MachineFilter(BaseModel):
+    """Selects machines for bulk operations; criteria combine with AND and at least one is required"""
+    machine_ids: Optional[List[str]] = None
+    operating_system: Optional[str] = Field(None, description="Exact operating system name")
+    os_version: Optional[str] = None
+    hostname_prefix: Optional[str] = Field(None, description="e.g. a department's naming prefix")
+    status: Optional[str] = Field(None, description="healthy, warning, critical or offline")
+    offline_for_days: Optional[float] = Field(None, gt=0, description="No check-in for at least this many days")
+
+class MachineBulkUpdate(BaseModel):
+    filter: MachineFilter
+    changes: MachineUpdate
+
 class Machine(MachineBase):
     machine_id: str
     cpu_usage: Optional[int] = None
     memory_usage: Optional[int] = None
     disk_usage: Optional[int] = None
     network_status: Optional[str] = None
+    metrics_summary: Optional[Dict[str, Any]] = None
     issues: Optional[List[Dict[str, Any]]] = []
     last_check_in: Optional[datetime] = None
+    is_online: bool = True
+    status: Optional[str] = None
     created_at: datetime
     updated_at: datetime
 
@@ -56,6 +100,22 @@ class SystemCheckCreate(SystemCheckBase):
 class SystemCheck(SystemCheckBase):
     id: int
     timestamp: datetime
+    status_changed: bool = True
+
+    class Config:
+        from_attributes = True
+
+class SystemCheckPage(BaseModel):
+    items: List[SystemCheck]
+    next_cursor: Optional[str] = Field(None, description="Pass as cursor to fetch the next (older) page")
+
+# Machine event schemas
+class MachineEvent(BaseModel):
+    id: int
+    machine_id: str
+    event_type: str
+    details: Optional[str] = None
+    timestamp: datetime
 
     class Config:
         from_attributes = True
@@ -101,6 +161,7 @@ class DashboardStats(BaseModel):
     healthy_machines: int
     warning_machines: int
     critical_machines: int
+    offline_machines: int
     compliance_rate: float
 
 class ComplianceOverview(BaseModel):
@@ -109,6 +170,21 @@ class ComplianceOverview(BaseModel):
     antivirus: Dict[str, int]
     sleep_settings: Dict[str, int]
 
+class ComplianceSnapshot(BaseModel):
+    period: str
+    period_start: datetime
+    operating_system: str
+    total_machines: int
+    online_machines: int
+    disk_encrypted: int
+    os_up_to_date: int
+    antivirus_active: int
+    sleep_settings_compliant: int
+    fully_compliant: int
+
+    class Config:
+        from_attributes = True
+
 # Issue schema
 class Issue(BaseModel):
     id: str
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Production launcher for the Solsphere API
+
+Runs several uvicorn worker processes on one port. Workers share no memory;
+in-process caches stay consistent through the DB-backed change counters in
+cache.py, so any worker can serve any request.
+"""
+
+import argparse
+import importlib.util
+import os
+
+import uvicorn
+
+from config import settings
+
+def _pick(module: str, preferred: str, fallback: str) -> str:
+    return preferred if importlib.util.find_spec(module) else fallback
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Solsphere API production server")
+    parser.add_argument("--host", default="0.0.0.0", help="Bind address (default: 0.0.0.0)")
+    parser.add_argument("--port", type=int, default=8000, help="Bind port (default: 8000)")
+    parser.add_argument("--workers", type=int, default=settings.workers,
+                        help="Worker processes (default: one per CPU core)")
+    parser.add_argument("--graceful-timeout", type=int, default=settings.graceful_shutdown_seconds,
+                        help="Seconds to drain in-flight requests on shutdown (default: 30)")
+    parser.add_argument("--keep-alive", type=int, default=75,
+                        help="Keep-alive timeout in seconds for agent connections (default: 75)")
+
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count() or 1
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=_pick("uvloop", "uvloop", "asyncio"),
+        http=_pick("httptools", "httptools", "h11"),
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+        access_log=False
+    )
+
+if __name__ == "__main__":
+    main()
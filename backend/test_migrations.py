@@ -0,0 +1,59 @@
+"""
+Migrations that rewrite existing rows must pick the same rows as the code
+paths that write new ones.
+
+Runs against a throwaway SQLite database migrated to the latest version,
+with rows inserted the way an older release left them.
+"""
+
+import os
+import tempfile
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/migrations_test.db"
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+import blobs
+import partitions
+from config import settings
+from database import engine
+from migrations import migrate, _detail_blobs
+
+@pytest.fixture(scope="module", autouse=True)
+def schema():
+    migrate(engine)
+
+def _insert_check(conn, details: str) -> int:
+    # Straight into the table, as rows written before migration 8 had no digest
+    table = partitions.writable_tables(conn)[0]
+    conn.execute(text(
+        f"INSERT INTO {table} (machine_id, check_type, status, details, timestamp) "
+        "VALUES ('m1', 'os_updates', 'pass', :details, :timestamp)"
+    ), {"details": details, "timestamp": datetime.utcnow()})
+    return conn.execute(text(f"SELECT max(id) FROM {table}")).scalar()
+
+def test_detail_blob_backfill_counts_utf8_bytes():
+    threshold = settings.detail_blob_min_bytes
+    payloads = [
+        "é" * (threshold // 2),              # Few characters, but exactly at the byte threshold
+        "é" * (threshold // 2 - 1) + "a",    # One byte short
+        "a" * (threshold - 1),
+        "a" * threshold,
+    ]
+    with engine.begin() as conn:
+        ids = [_insert_check(conn, details) for details in payloads]
+        _detail_blobs(conn)
+        rows = {row.id: row for row in conn.execute(
+            text("SELECT id, details, details_digest FROM system_checks")
+        )}
+
+    for check_id, details in zip(ids, payloads):
+        row = rows[check_id]
+        if blobs.should_store(details):
+            assert row.details is None and row.details_digest == blobs.digest_of(details)
+        else:
+            assert row.details == details and row.details_digest is None
+    assert [blobs.should_store(details) for details in payloads] == [True, False, False, True]
@@ -24,6 +24,7 @@ export const useDashboardStore = defineStore('dashboard', {
     },
     recentActivity: [],
     osDistribution: [],
+    statusByOs: {},
     loading: false,
     error: null
   }),
@@ -41,58 +42,33 @@ export const useDashboardStore = defineStore('dashboard', {
       this.error = null
       
       try {
-        const [statsResponse, complianceResponse] = await Promise.all([
+        const [statsResponse, complianceResponse, distributionResponse, activityResponse] = await Promise.all([
           api.get('/api/dashboard/stats'),
-          api.get('/api/dashboard/compliance')
+          api.get('/api/dashboard/compliance'),
+          api.get('/api/dashboard/distribution'),
+          api.get('/api/dashboard/activity', { params: { limit: 10 } })
         ])
         
-        this.stats = statsResponse.data
+        const stats = statsResponse.data
+        this.stats = {
+          totalMachines: stats.total_machines,
+          healthyMachines: stats.healthy_machines,
+          warningMachines: stats.warning_machines,
+          criticalMachines: stats.critical_machines,
+          offlineMachines: stats.offline_machines
+        }
         this.compliance = complianceResponse.data
-        
-        // Generate mock data for demo purposes
-        this.generateMockData()
+        this.osDistribution = distributionResponse.data.operating_systems
+        this.statusByOs = distributionResponse.data.status_by_os
+        this.recentActivity = activityResponse.data
       } catch (error) {
         this.error = 'Failed to fetch dashboard data'
         console.error('Error fetching dashboard data:', error)
-        // Generate mock data as fallback
-        this.generateMockData()
       } finally {
         this.loading = false
       }
     },
 
-    generateMockData() {
-      // Mock recent activity
-      this.recentActivity = [
-        {
-          id: 1,
-          message: 'Machine WIN-ABC123 completed health check',
-          status: 'healthy',
-          timestamp: new Date(Date.now() - 5 * 60000).toISOString()
-        },
-        {
-          id: 2,
-          message: 'Machine MAC-DEF456 detected disk encryption issue',
-          status: 'warning',
-          timestamp: new Date(Date.now() - 15 * 60000).toISOString()
-        },
-        {
-          id: 3,
-          message: 'Machine LIN-GHI789 antivirus scan completed',
-          status: 'healthy',
-          timestamp: new Date(Date.now() - 30 * 60000).toISOString()
-        }
-      ]
-
-      // Mock OS distribution
-      this.osDistribution = [
-        { name: 'Windows 11', count: 45, percentage: 45 },
-        { name: 'Windows 10', count: 30, percentage: 30 },
-        { name: 'macOS', count: 15, percentage: 15 },
-        { name: 'Linux', count: 10, percentage: 10 }
-      ]
-    },
-
     async refreshData() {
       await this.fetchDashboardStats()
     }
@@ -7,44 +7,36 @@ const api = axios.create({
   baseURL: config.apiBaseUrl
 })
 
+// Columns the machine table shows; full machines are fetched on demand
+const TABLE_FIELDS = [
+  'machine_id',
+  'hostname',
+  'operating_system',
+  'os_version',
+  'status',
+  'last_check_in',
+  'issue_count'
+]
+
 export const useMachinesStore = defineStore('machines', {
   state: () => ({
     machines: [],
     loading: false,
     error: null,
+    // Server-side sort for the table: an indexed field, '-' prefix for descending
+    sort: '-last_check_in',
+    // Filters, search and paging run on the server; the table holds one page
     filters: {
       os: '',
       status: '',
       search: ''
-    }
+    },
+    page: 0,
+    pageSize: 50,
+    hasMore: false
   }),
 
   getters: {
-    filteredMachines: (state) => {
-      let filtered = state.machines
-
-      if (state.filters.os) {
-        filtered = filtered.filter(machine => 
-          machine.operating_system.toLowerCase().includes(state.filters.os.toLowerCase())
-        )
-      }
-
-      if (state.filters.status) {
-        filtered = filtered.filter(machine => 
-          machine.status === state.filters.status
-        )
-      }
-
-      if (state.filters.search) {
-        filtered = filtered.filter(machine => 
-          machine.hostname.toLowerCase().includes(state.filters.search.toLowerCase()) ||
-          machine.machine_id.toLowerCase().includes(state.filters.search.toLowerCase())
-        )
-      }
-
-      return filtered
-    },
-
     machinesByStatus: (state) => {
       const statusCounts = {
         healthy: 0,
@@ -53,17 +45,10 @@ export const useMachinesStore = defineStore('machines', {
         offline: 0
       }
 
+      // The API stores each machine's status, including offline
       state.machines.forEach(machine => {
-        if (machine.last_check_in && Date.now() - new Date(machine.last_check_in).getTime() > 3600000) {
-          statusCounts.offline++
-        } else if (machine.issues && machine.issues.length > 0) {
-          if (machine.issues.some(issue => issue.severity === 'critical')) {
-            statusCounts.critical++
-          } else {
-            statusCounts.warning++
-          }
-        } else {
-          statusCounts.healthy++
+        if (machine.status in statusCounts) {
+          statusCounts[machine.status]++
         }
       })
 
@@ -72,12 +57,12 @@ export const useMachinesStore = defineStore('machines', {
   },
 
   actions: {
-    async fetchMachines() {
+    async fetchMachines(params = {}) {
       this.loading = true
       this.error = null
       
       try {
-        const response = await api.get('/api/machines')
+        const response = await api.get('/api/machines', { params })
         this.machines = response.data
       } catch (error) {
         this.error = 'Failed to fetch machines'
@@ -87,6 +72,45 @@ export const useMachinesStore = defineStore('machines', {
       }
     },
 
+    async fetchMachineList() {
+      // Just the table columns of one page, filtered and sorted by the API; issues stay on the server
+      const params = {
+        fields: TABLE_FIELDS.join(','),
+        sort: this.sort,
+        skip: this.page * this.pageSize,
+        // One extra row tells whether there is a next page
+        limit: this.pageSize + 1
+      }
+      if (this.filters.os) params.os_filter = this.filters.os
+      if (this.filters.status) params.status_filter = this.filters.status
+      if (this.filters.search) params.search = this.filters.search
+
+      this.loading = true
+      this.error = null
+
+      try {
+        const response = await api.get('/api/machines', { params })
+        this.hasMore = response.data.length > this.pageSize
+        this.machines = response.data.slice(0, this.pageSize)
+      } catch (error) {
+        this.error = 'Failed to fetch machines'
+        console.error('Error fetching machines:', error)
+      } finally {
+        this.loading = false
+      }
+    },
+
+    setSort(field) {
+      this.sort = this.sort === field ? `-${field}` : field
+      this.page = 0
+      return this.fetchMachineList()
+    },
+
+    setPage(page) {
+      this.page = Math.max(page, 0)
+      return this.fetchMachineList()
+    },
+
     async fetchMachineById(machineId) {
       try {
         const response = await api.get(`/api/machines/${machineId}`)
@@ -99,6 +123,8 @@ export const useMachinesStore = defineStore('machines', {
 
     setFilter(filterType, value) {
       this.filters[filterType] = value
+      this.page = 0
+      return this.fetchMachineList()
     },
 
     clearFilters() {
@@ -107,6 +133,8 @@ export const useMachinesStore = defineStore('machines', {
         status: '',
         search: ''
       }
+      this.page = 0
+      return this.fetchMachineList()
     }
   }
 })
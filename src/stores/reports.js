@@ -0,0 +1,69 @@
+import { defineStore } from 'pinia'
+import axios from 'axios'
+import { config } from '../config'
+
+// Create axios instance with base URL
+const api = axios.create({
+  baseURL: config.apiBaseUrl
+})
+
+export const useReportsStore = defineStore('reports', {
+  state: () => ({
+    complianceTrend: [],
+    // Fleet totals from the dashboard endpoints, so reports never load machine rows
+    stats: null,
+    compliance: {},
+    loading: false,
+    error: null
+  }),
+
+  getters: {
+    // Percent of machines compliant with each check, one point per snapshot
+    complianceTrendRates: (state) => {
+      const rate = (count, total) => total > 0 ? Math.round(count / total * 100) : 0
+      return state.complianceTrend.map(snapshot => ({
+        date: snapshot.period_start,
+        diskEncryption: rate(snapshot.disk_encrypted, snapshot.total_machines),
+        osUpdates: rate(snapshot.os_up_to_date, snapshot.total_machines),
+        antivirus: rate(snapshot.antivirus_active, snapshot.total_machines),
+        sleepSettings: rate(snapshot.sleep_settings_compliant, snapshot.total_machines),
+        fullyCompliant: rate(snapshot.fully_compliant, snapshot.total_machines)
+      }))
+    }
+  },
+
+  actions: {
+    async fetchComplianceTrend(days = 90, operatingSystem = 'all') {
+      this.loading = true
+      this.error = null
+
+      try {
+        const response = await api.get('/api/reports/compliance-trend', {
+          params: { days, period: 'daily', operating_system: operatingSystem }
+        })
+        this.complianceTrend = response.data
+      } catch (error) {
+        this.error = 'Failed to fetch compliance trend'
+        console.error('Error fetching compliance trend:', error)
+      } finally {
+        this.loading = false
+      }
+    },
+
+    async fetchSummary() {
+      this.error = null
+
+      try {
+        const [statsResponse, complianceResponse] = await Promise.all([
+          api.get('/api/dashboard/stats'),
+          api.get('/api/dashboard/compliance')
+        ])
+        this.stats = statsResponse.data
+        this.compliance = complianceResponse.data
+      } catch (error) {
+        this.error = 'Failed to fetch fleet summary'
+        console.error('Error fetching fleet summary:', error)
+      }
+    }
+  }
+})
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Agent overhead benchmark for the Solsphere System Utility
+
+Measures the CPU time, wall time and memory of health check cycles on this host,
+and estimates the agent's steady-state share of one core from each check's cost
+and schedule plus the idle cost of the running daemon (metric sampler, file
+watcher, loop), measured over a wall-clock window. Nothing is sent to the API.
+"""
+
+import argparse
+import logging
+import statistics
+import sys
+import threading
+import time
+
+import main
+from main import SystemHealthChecker, SystemUtility, resource_usage
+
+CHECK_METHODS = {
+    "metrics": "get_system_metrics",
+    "sleep_settings": "check_sleep_settings",
+    "antivirus": "check_antivirus",
+    "disk_encryption": "check_disk_encryption",
+    "os_updates": "check_os_updates",
+}
+
+def measure(func, runs: int) -> dict:
+    """Median wall and CPU seconds (including child processes) of ``func`` over ``runs`` calls"""
+    wall, cpu = [], []
+    for _ in range(runs):
+        usage_start, start = resource_usage(), time.perf_counter()
+        func()
+        wall.append(time.perf_counter() - start)
+        cpu.append(resource_usage()["cpu_seconds"] - usage_start["cpu_seconds"])
+    return {"wall": statistics.median(wall), "cpu": statistics.median(cpu)}
+
+def measure_daemon(warmup: float, window: float) -> dict:
+    """CPU share of one core and RSS of ``start_daemon`` over ``window`` seconds after ``warmup``
+
+    Process CPU time covers every thread, so the sampler and watcher are included.
+    """
+    utility = SystemUtility(startup_jitter=0)
+    # Keep the daemon offline: reports and heartbeats go nowhere
+    utility._deliver = lambda health_data: True
+    utility._check_in = lambda health_data: None
+    result = {}
+
+    def start_window():
+        result["start"] = resource_usage()["cpu_seconds"]
+
+    def stop():
+        result["cpu"] = resource_usage()["cpu_seconds"] - result["start"]
+        result["rss_mb"] = resource_usage()["rss_mb"]
+        utility.running = False
+        utility._wakeup.set()
+
+    timers = [threading.Timer(warmup, start_window), threading.Timer(warmup + window, stop)]
+    for timer in timers:
+        timer.start()
+    # start_daemon installs signal handlers, so it has to run on the main thread
+    utility.start_daemon()
+    utility.health_checker.executor.shutdown(wait=False)
+    return {"share": result["cpu"] / window, "rss_mb": result["rss_mb"]}
+
+def main_benchmark():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Solsphere agent overhead benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs per measurement (default: 5)")
+    parser.add_argument("--max-core-percent", type=float, default=1.0,
+                        help="Fail if the steady-state estimate exceeds this share of one core (default: 1.0)")
+    parser.add_argument("--daemon-seconds", type=float, default=60.0,
+                        help="Wall-clock window to measure the idle daemon over (default: 60)")
+    parser.add_argument("--warmup-seconds", type=float, default=15.0,
+                        help="Daemon run time before the window opens, covering the first full cycle (default: 15)")
+    args = parser.parse_args()
+
+    logging.getLogger(main.__name__).setLevel(logging.WARNING)
+    checker = SystemHealthChecker()
+
+    full = measure(lambda: checker.run_health_check(force=True), args.runs)
+    print(f"full cycle: {full['wall'] * 1000:.1f} ms wall, {full['cpu'] * 1000:.1f} ms CPU")
+    cached = measure(checker.run_health_check, args.runs)
+    print(f"cycle with fresh cache: {cached['wall'] * 1000:.1f} ms wall, {cached['cpu'] * 1000:.1f} ms CPU")
+
+    # Steady state: every check costs its CPU time once per interval
+    core_share = 0.0
+    for name, method in CHECK_METHODS.items():
+        cost = measure(getattr(checker, method), args.runs)
+        interval = checker.check_intervals[name]
+        core_share += cost["cpu"] / interval
+        print(f"{name}: {cost['cpu'] * 1000:.1f} ms CPU every {interval / 60:.0f} min")
+
+    checker.executor.shutdown(wait=False)
+
+    # Background threads run whether or not a check is due
+    daemon = measure_daemon(args.warmup_seconds, args.daemon_seconds)
+    print(f"idle daemon: {daemon['share'] * 100:.4f}% of one core over {args.daemon_seconds:.0f} s, "
+          f"RSS {daemon['rss_mb']:.1f} MB")
+    core_share += daemon["share"]
+
+    print(f"peak RSS: {resource_usage()['rss_mb']:.1f} MB")
+    print(f"estimated steady-state load: {core_share * 100:.4f}% of one core "
+          f"(budget {args.max_core_percent}%)")
+    return 0 if core_share * 100 <= args.max_core_percent else 1
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
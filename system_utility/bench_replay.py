@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the Solsphere System Utility
+
+Replays recorded command output (see ``main.py --record``) through the health
+checks, so parsing latency and allocations can be measured and compared for
+every platform on any machine, without running the real tools.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import main
+from main import SystemHealthChecker
+from runners import ReplayRunner
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def replay(path: str, runs: int) -> dict:
+    """Median latency and allocation of a forced health check cycle against one fixture"""
+    with open(path, 'r') as f:
+        fixture = json.load(f)
+    checker = SystemHealthChecker(runner=ReplayRunner(fixture), operating_system=fixture["platform"])
+    wall, peak, retained = [], [], []
+    try:
+        for _ in range(runs):
+            tracemalloc.start()
+            start = time.perf_counter()
+            checker.run_health_check(force=True)
+            wall.append(time.perf_counter() - start)
+            current, high = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            peak.append(high)
+            retained.append(current)
+    finally:
+        checker.executor.shutdown(wait=False)
+    return {
+        "platform": fixture["platform"],
+        "wall": statistics.median(wall),
+        "peak_kb": statistics.median(peak) / 1024,
+        "retained_kb": statistics.median(retained) / 1024,
+    }
+
+def main_benchmark():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Solsphere agent offline replay benchmark")
+    parser.add_argument("fixtures", nargs="*",
+                        help="Fixture files to replay (default: every file in fixtures/)")
+    parser.add_argument("--runs", type=int, default=20, help="Number of cycles per fixture (default: 20)")
+    args = parser.parse_args()
+
+    logging.getLogger(main.__name__).setLevel(logging.ERROR)
+    paths = args.fixtures or sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.json")))
+    if not paths:
+        print("No fixtures found")
+        return 1
+
+    for path in paths:
+        result = replay(path, args.runs)
+        print(f"{os.path.basename(path)} ({result['platform']}): {result['wall'] * 1000:.2f} ms per cycle, "
+              f"{result['peak_kb']:.1f} KB peak, {result['retained_kb']:.1f} KB retained")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
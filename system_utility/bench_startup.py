@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for the Solsphere System Utility
+
+Measures, in fresh processes, how long it takes to import the agent, to start
+it without and with a saved state file, and to produce a report from cached
+check results, which is what short-lived invocations pay. Nothing is sent to
+the API.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SNIPPETS = {
+    "import main": (
+        "import time; t = time.perf_counter(); import main; "
+        "print(time.perf_counter() - t)"
+    ),
+    "start, no state file": (
+        "import os, time; t = time.perf_counter(); import main; "
+        "os.path.exists('state.json') and os.remove('state.json'); "
+        "main.SystemHealthChecker(state_file='state.json'); "
+        "print(time.perf_counter() - t)"
+    ),
+    "start, saved state file": (
+        "import time; t = time.perf_counter(); import main; "
+        "main.SystemHealthChecker(state_file='state.json'); "
+        "print(time.perf_counter() - t)"
+    ),
+    "start and cached report": (
+        "import time; t = time.perf_counter(); import main; "
+        "c = main.SystemHealthChecker(cache_file='cache.json', state_file='state.json'); "
+        "c.build_report(c.run_health_check()); "
+        "print(time.perf_counter() - t)"
+    ),
+}
+
+def measure(snippet: str, workdir: str) -> float:
+    # Run from a scratch directory so state, cache and log files stay out of the tree
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [AGENT_DIR, os.environ.get("PYTHONPATH")])))
+    result = subprocess.run([sys.executable, "-c", snippet], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+def _report(name: str, samples: list):
+    print(f"{name}: min {min(samples) * 1000:.1f} ms, "
+          f"median {statistics.median(samples) * 1000:.1f} ms, "
+          f"max {max(samples) * 1000:.1f} ms ({len(samples)} runs)")
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Solsphere agent startup benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs (default: 5)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Fill the check cache once so the last measurement only reuses results
+        measure(SNIPPETS["start and cached report"], workdir)
+        for name, snippet in SNIPPETS.items():
+            _report(name, [measure(snippet, workdir) for _ in range(args.runs)])
+
+if __name__ == "__main__":
+    main()
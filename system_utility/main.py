@@ -8,15 +8,31 @@ import os
 import sys
 import time
 import json
+import zlib
 import logging
 import platform
+import select
+import sqlite3
+import struct
+from array import array
+import ctypes
+import glob
+import gzip
+import hashlib
+import random
 import subprocess
-import requests
+import importlib
 from datetime import datetime
 from typing import Dict, Any, Optional
-import psutil
 import threading
 import signal
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import msgpack
+except ImportError:  # Older installs keep talking JSON
+    msgpack = None
+from runners import CommandRunner, SubprocessRunner, RecordingRunner
 
 # Configure logging
 logging.basicConfig(
@@ -29,52 +45,664 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access.
+
+    ``requests`` and ``psutil`` take most of the agent's import time, while
+    recording, cached cycles and ``--help`` never touch them.
+    """
+    
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+requests = LazyModule("requests")
+psutil = LazyModule("psutil")
+
+# Native Linux probes: read the kernel and systemd state directly instead of forking tools
+
+def _proc_partitions(proc_root: str = "/proc") -> Optional[Dict[str, str]]:
+    """Block device name -> ``major:minor`` from ``/proc/partitions``, or None if unreadable"""
+    try:
+        with open(os.path.join(proc_root, "partitions"), 'r') as f:
+            lines = f.read().splitlines()[2:]  # Header line and a blank line
+    except OSError:
+        return None
+    devices = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 4:
+            devices[fields[3]] = f"{fields[0]}:{fields[1]}"
+    return devices
+
+def _linux_luks_devices(sys_root: str = "/sys", udev_data: str = "/run/udev/data",
+                        proc_root: str = "/proc") -> Optional[list]:
+    """Block devices that are LUKS volumes or open dm-crypt LUKS mappings.
+
+    Uses the same sources as ``lsblk -f``: ``/sys/class/block/*/dm/uuid`` for
+    active mappings and, where udev runs, its database for on-disk LUKS headers.
+    Without sysfs, devices are listed from ``/proc/partitions`` and only the
+    udev database is consulted. Returns None when neither sysfs nor both of
+    ``/proc/partitions`` and udev are available, so the caller can fall back
+    to a subprocess.
+    """
+    block_dir = os.path.join(sys_root, "class", "block")
+    has_sysfs = os.path.isdir(block_dir)
+    has_udev = os.path.isdir(udev_data)
+    partitions = _proc_partitions(proc_root)
+    if has_sysfs:
+        names = sorted(os.listdir(block_dir))
+    elif has_udev and partitions is not None:
+        names = sorted(partitions)
+    else:
+        return None
+    devices = []
+    for device in names:
+        if has_sysfs:
+            try:
+                with open(os.path.join(block_dir, device, "dm", "uuid"), 'r') as f:
+                    if f.read().startswith("CRYPT-LUKS"):
+                        devices.append(device)
+                        continue
+            except OSError:
+                pass
+        if not has_udev:
+            continue
+        try:
+            if has_sysfs:
+                with open(os.path.join(block_dir, device, "dev"), 'r') as f:
+                    dev_number = f.read().strip()
+            else:
+                dev_number = partitions[device]
+            with open(os.path.join(udev_data, f"b{dev_number}"), 'r') as f:
+                if "E:ID_FS_TYPE=crypto_LUKS\n" in f.read():
+                    devices.append(device)
+        except OSError:
+            continue
+    return devices
+
+def _parse_systemd_config(paths: list) -> Dict[str, str]:
+    """Merge ``Key=Value`` settings from systemd-style config files, later files winning"""
+    settings = {}
+    for path in paths:
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line[0] in "#;[" or "=" not in line:
+                        continue
+                    key, _, value = line.partition("=")
+                    settings[key.strip()] = value.strip()
+        except OSError:
+            continue
+    return settings
+
+def _logind_config(root: str = "/") -> Optional[Dict[str, str]]:
+    """Effective logind settings, or None when systemd is not running"""
+    if not os.path.isdir(os.path.join(root, "run/systemd/system")):
+        return None
+    paths = []
+    for base in ("usr/lib/systemd", "etc/systemd", "run/systemd"):
+        paths.append(os.path.join(root, base, "logind.conf"))
+        paths.extend(sorted(glob.glob(os.path.join(root, base, "logind.conf.d", "*.conf"))))
+    return _parse_systemd_config(paths)
+
+# The pass/fail field of each check; free-form details and command output are left out
+CHECK_VERDICTS = {
+    "disk_encryption": "encrypted",
+    "os_updates": "up_to_date",
+    "antivirus": "active",
+    "sleep_settings": "compliant",
+}
+
+def fingerprint(health_data: Dict[str, Any]) -> str:
+    """Stable hash of the state the API stores, ignoring metrics and volatile check output"""
+    checks = health_data.get("checks", {})
+    state = {
+        "hostname": health_data.get("hostname"),
+        "operating_system": health_data.get("operating_system"),
+        "os_version": health_data.get("os_version"),
+        "checks": {name: bool(checks.get(name, {}).get(verdict)) for name, verdict in CHECK_VERDICTS.items()},
+        "issues": sorted((issue.get("type"), issue.get("severity"), issue.get("message"))
+                         for issue in health_data.get("issues", [])),
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+def resource_usage() -> Dict[str, float]:
+    """CPU seconds used by this process and its finished commands, and current RSS in MB"""
+    times = os.times()
+    return {
+        "cpu_seconds": time.process_time() + times.children_user + times.children_system,
+        "rss_mb": psutil.Process().memory_info().rss / (1024 * 1024),
+    }
+
+class RingBuffer:
+    """Fixed-size ring of floats backed by a preallocated array"""
+    
+    def __init__(self, capacity: int):
+        self.data = array('d', bytes(8 * capacity))
+        self.capacity = capacity
+        self.index = 0
+        self.count = 0
+        self.appended = 0  # Total ever appended, to tell which values arrived after a point
+    
+    def append(self, value: float):
+        self.data[self.index] = value
+        self.index = (self.index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.appended += 1
+    
+    def keep_newest(self, count: int):
+        """Forget all but the ``count`` most recent values"""
+        self.count = min(self.count, max(0, count))
+    
+    def summary(self) -> Optional[Dict[str, float]]:
+        """min/avg/max/p95 of the buffered values, or None if empty"""
+        if not self.count:
+            return None
+        start = (self.index - self.count) % self.capacity
+        values = sorted(self.data[(start + i) % self.capacity] for i in range(self.count))
+        return {
+            "min": round(values[0], 2),
+            "avg": round(sum(values) / self.count, 2),
+            "max": round(values[-1], 2),
+            "p95": round(values[min(self.count - 1, int(0.95 * self.count))], 2),
+            "samples": self.count,
+        }
+
+class MetricSampler:
+    """Background thread sampling CPU, memory, disk and network every few seconds.
+
+    Samples go into ring buffers sized for ``window_seconds``; each report takes a
+    summary of everything sampled since the previous delivered one. The samples it
+    covers are only dropped by ``commit()`` once that report is sent or spooled.
+    """
+    
+    SERIES = ("cpu", "memory", "disk", "net_sent_bytes_per_sec", "net_recv_bytes_per_sec")
+    
+    def __init__(self, interval_seconds: float = 5.0, window_seconds: float = 3600):
+        self.interval_seconds = interval_seconds
+        capacity = max(1, int(window_seconds / interval_seconds))
+        self.buffers = {name: RingBuffer(capacity) for name in self.SERIES}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_net = None
+        self._window_start = time.time()
+        self._snapshot = None  # (appended per series, time) of the last summary
+    
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="metric-sampler", daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        self._stopped.set()
+    
+    def _run(self):
+        while not self._stopped.wait(self.interval_seconds):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.debug(f"Metric sample failed: {e}")
+    
+    def sample(self):
+        now = time.monotonic()
+        values = {
+            "cpu": psutil.cpu_percent(interval=None),
+            "memory": psutil.virtual_memory().percent,
+            "disk": psutil.disk_usage('/').percent,
+        }
+        net = psutil.net_io_counters()
+        if net is not None:
+            if self._last_net is not None:
+                elapsed = now - self._last_net[0]
+                if elapsed > 0:
+                    values["net_sent_bytes_per_sec"] = max(0, net.bytes_sent - self._last_net[1]) / elapsed
+                    values["net_recv_bytes_per_sec"] = max(0, net.bytes_recv - self._last_net[2]) / elapsed
+            self._last_net = (now, net.bytes_sent, net.bytes_recv)
+        with self._lock:
+            for name, value in values.items():
+                self.buffers[name].append(value)
+    
+    def summarize(self) -> Optional[Dict[str, Any]]:
+        """Summaries since the last commit; the samples stay buffered until ``commit()``"""
+        with self._lock:
+            series = {name: buffer.summary() for name, buffer in self.buffers.items()}
+            now = time.time()
+            self._snapshot = ({name: buffer.appended for name, buffer in self.buffers.items()}, now)
+        if not any(series.values()):
+            return None
+        return dict(series, window_seconds=round(now - self._window_start, 1))
+    
+    def commit(self):
+        """Start a new window after the last summary, keeping samples taken since"""
+        with self._lock:
+            if self._snapshot is None:
+                return
+            appended, taken_at = self._snapshot
+            for name, buffer in self.buffers.items():
+                buffer.keep_newest(buffer.appended - appended[name])
+            self._window_start, self._snapshot = taken_at, None
+
+LINUX_ANTIVIRUS = ['clamav', 'chkrootkit', 'rkhunter']
+
+class InotifyWatcher:
+    """Linux inotify watches on the files each check reads.
+
+    A change to a watched path marks its check for re-run; events are debounced so
+    a burst (an apt upgrade touching hundreds of files) triggers a single re-check.
+    ``on_trigger`` is called from the watcher thread with the set of check names.
+    """
+    
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct("iIII")
+    
+    def __init__(self, on_trigger, debounce_seconds: float = 5.0):
+        self.on_trigger = on_trigger
+        self.debounce_seconds = debounce_seconds
+        self.fd = None
+        self.watches: Dict[int, tuple] = {}
+        self._thread = None
+        self._stopped = threading.Event()
+    
+    @staticmethod
+    def default_watches() -> list:
+        """(directory, file names or None for any, check) triples"""
+        watches = [
+            ("/etc", {"crypttab"}, "disk_encryption"),
+            ("/etc/systemd", {"logind.conf", "sleep.conf"}, "sleep_settings"),
+            ("/etc/systemd/logind.conf.d", None, "sleep_settings"),
+            ("/var/lib/dpkg", {"status"}, "os_updates"),
+            ("/var/lib/apt/lists", None, "os_updates"),
+        ]
+        for directory in dict.fromkeys(os.environ.get("PATH", "").split(os.pathsep)):
+            if directory:
+                watches.append((directory, set(LINUX_ANTIVIRUS), "antivirus"))
+        return watches
+    
+    def start(self, watches: Optional[list] = None) -> bool:
+        """Start watching; False when inotify is unavailable (non-Linux, no libc)"""
+        if platform.system() != "Linux":
+            return False
+        import ctypes.util  # Pulls in tempfile and friends; only the daemon needs it
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return False
+        if fd < 0:
+            return False
+        
+        self.fd = fd
+        for directory, names, check in (watches if watches is not None else self.default_watches()):
+            if not os.path.isdir(directory):
+                continue
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), self.EVENT_MASK)
+            if wd >= 0:
+                self.watches.setdefault(wd, []).append((names, check))
+        if not self.watches:
+            self.stop()
+            return False
+        
+        self._thread = threading.Thread(target=self._run, name="inotify-watcher", daemon=True)
+        self._thread.start()
+        return True
+    
+    def watched_checks(self) -> set:
+        return {check for entries in self.watches.values() for _, check in entries}
+    
+    def stop(self):
+        self._stopped.set()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+    
+    def _checks_for(self, wd: int, name: str) -> set:
+        return {check for names, check in self.watches.get(wd, ()) if names is None or name in names}
+    
+    def _run(self):
+        pending = set()
+        deadline = None
+        while not self._stopped.is_set():
+            timeout = 1.0 if deadline is None else max(0.0, min(1.0, deadline - time.monotonic()))
+            try:
+                readable, _, _ = select.select([self.fd], [], [], timeout)
+                data = os.read(self.fd, 65536) if readable else b""
+            except (OSError, TypeError, ValueError):
+                return  # Closed by stop()
+            
+            offset = 0
+            while offset + self.EVENT_HEADER.size <= len(data):
+                wd, _, _, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = data[offset:offset + name_len].rstrip(b"\0").decode(errors="replace")
+                offset += name_len
+                checks = self._checks_for(wd, name)
+                if checks:
+                    pending |= checks
+                    # Trailing debounce: wait for the burst to settle
+                    deadline = time.monotonic() + self.debounce_seconds
+            
+            if deadline is not None and time.monotonic() >= deadline:
+                triggered, pending, deadline = pending, set(), None
+                logger.info(f"Detected changes affecting: {', '.join(sorted(triggered))}")
+                self.on_trigger(triggered)
+
+class CheckCache:
+    """Last result of each check with the time it ran, optionally persisted to a JSON file"""
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if path:
+            self.load()
+    
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                self.entries = entries
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable check cache {self.path}: {e}")
+    
+    def save(self):
+        if not self.path:
+            return
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save check cache {self.path}: {e}")
+    
+    def age(self, name: str, now: float) -> Optional[float]:
+        """Seconds since the check last ran, or None if it never did"""
+        entry = self.entries.get(name)
+        return now - entry.get("checked_at", 0) if entry else None
+    
+    def get(self, name: str, ttl: float, now: float) -> Optional[Dict[str, Any]]:
+        """Return the cached result if it is younger than ``ttl`` seconds"""
+        entry = self.entries.get(name)
+        if entry and 0 <= now - entry.get("checked_at", 0) < ttl:
+            return entry.get("result")
+        return None
+    
+    def put(self, name: str, result: Dict[str, Any], now: float):
+        self.entries[name] = {"result": result, "checked_at": now}
+    
+    def invalidate(self, name: str):
+        self.entries.pop(name, None)
+    
+    def next_due(self, intervals: Dict[str, float], now: float,
+                 not_before: Optional[Dict[str, float]] = None) -> float:
+        """Seconds until the first check's cached result expires (or its deferral ends)"""
+        not_before = not_before or {}
+        delays = [max(self.entries.get(name, {}).get("checked_at", 0) + ttl, not_before.get(name, 0)) - now
+                  for name, ttl in intervals.items()]
+        return max(0.0, min(delays)) if delays else 0.0
+
+class HostState:
+    """Machine identity and static host facts, kept in a small JSON state file.
+
+    Resolving the identity forks ``system_profiler`` or ``wmic``, which takes
+    seconds. The saved facts are reused while the host still looks the same
+    (OS, hostname, kernel and architecture from ``uname``) and re-resolved weekly.
+    """
+    
+    MAX_AGE = 7 * 24 * 3600
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.state: Dict[str, Any] = {}
+        if path:
+            self.load()
+    
+    @staticmethod
+    def host_key(operating_system: str) -> Dict[str, str]:
+        """Cheap facts that change whenever the cached identity might be stale"""
+        return {
+            "system": operating_system,
+            "node": platform.node(),
+            "release": platform.release(),
+            "version": platform.version(),
+            "machine": platform.machine(),
+        }
+    
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+            if isinstance(state, dict):
+                self.state = state
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable state file {self.path}: {e}")
+    
+    def save(self):
+        if not self.path:
+            return
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save state file {self.path}: {e}")
+    
+    def get(self, key: Dict[str, str], now: float) -> Optional[Dict[str, str]]:
+        """Return the saved facts if they were resolved on this host within MAX_AGE"""
+        if self.state.get("key") == key and 0 <= now - self.state.get("resolved_at", 0) < self.MAX_AGE:
+            return self.state.get("facts")
+        return None
+    
+    def put(self, key: Dict[str, str], facts: Dict[str, str], now: float):
+        self.state = {"key": key, "facts": facts, "resolved_at": now}
+        self.save()
+
+class ReportSpool:
+    """Durable SQLite queue of reports the API has not acknowledged yet.
+
+    Reports are stored zlib-compressed in arrival order and bounded by count and
+    age, dropping the oldest first, so a machine that is offline for days keeps
+    a recent history without filling the disk.
+    """
+    
+    def __init__(self, path: str, max_reports: int = 5000, max_age_days: float = 14):
+        self.path = path
+        self.max_reports = max_reports
+        self.max_age_seconds = max_age_days * 86400
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS reports ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, payload BLOB NOT NULL)"
+        )
+        self.conn.commit()
+    
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+    
+    def append(self, report: Dict[str, Any]):
+        payload = zlib.compress(json.dumps(report).encode())
+        with self.conn:
+            self.conn.execute("INSERT INTO reports (created_at, payload) VALUES (?, ?)",
+                              (time.time(), payload))
+        self.prune()
+    
+    def prune(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM reports WHERE created_at < ?",
+                              (time.time() - self.max_age_seconds,))
+            self.conn.execute(
+                "DELETE FROM reports WHERE id <= "
+                "(SELECT id FROM reports ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (self.max_reports,)
+            )
+    
+    def peek(self, limit: int) -> list:
+        """Oldest spooled reports as (id, report) pairs"""
+        rows = self.conn.execute("SELECT id, payload FROM reports ORDER BY id LIMIT ?", (limit,))
+        return [(row_id, json.loads(zlib.decompress(payload))) for row_id, payload in rows]
+    
+    def remove(self, ids: list):
+        with self.conn:
+            self.conn.executemany("DELETE FROM reports WHERE id = ?", [(row_id,) for row_id in ids])
+
 class SystemHealthChecker:
     """System health checker for different operating systems"""
     
-    def __init__(self, api_endpoint: str = "http://localhost:8000"):
+    # Seconds a result stays fresh; cheap metrics are resampled often, slow update scans rarely
+    DEFAULT_CHECK_INTERVALS = {
+        "metrics": 60,
+        "sleep_settings": 60 * 60,
+        "antivirus": 60 * 60,
+        "disk_encryption": 6 * 60 * 60,
+        "os_updates": 4 * 60 * 60,
+    }
+    FAILED_CHECK_RETRY = 5 * 60
+    
+    # Checks that fork heavy tools; with defer_when_busy they wait for an idle host on AC power,
+    # reusing their last result for up to MAX_DEFERRAL seconds past its lifetime and
+    # looking again every FAILED_CHECK_RETRY seconds
+    EXPENSIVE_CHECKS = {"os_updates", "disk_encryption"}
+    MAX_DEFERRAL = 24 * 60 * 60
+    BUSY_LOAD_PER_CORE = 0.8
+    
+    # HTTP: (connect, read) timeouts and retry policy for transient failures
+    REQUEST_TIMEOUT = (5, 30)
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 1.0  # Base delay in seconds, doubled per attempt
+    MAX_RETRY_WAIT = 60  # Longer Retry-After values are left to the check-in schedule
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    REJECTED_STATUSES = (413, 422)  # Spooled batches the server will never accept
+    
+    def __init__(self, api_endpoint: str = "http://localhost:8000", check_timeout: int = 60,
+                 check_intervals: Optional[Dict[str, float]] = None, cache_file: Optional[str] = None,
+                 max_subprocesses: int = 5, defer_when_busy: bool = False,
+                 runner: Optional[CommandRunner] = None, operating_system: Optional[str] = None,
+                 state_file: Optional[str] = None):
         self.api_endpoint = api_endpoint
-        self.machine_id = self._get_machine_id()
-        self.hostname = platform.node()
-        self.operating_system = platform.system()
-        self.os_version = platform.version()
-        
-    def _get_machine_id(self) -> str:
-        """Get unique machine identifier"""
-        if platform.system() == "Windows":
+        # Every command goes through the runner so checks can be recorded and replayed
+        self.runner = runner or SubprocessRunner()
+        # Native Linux probes read the live host, so only use them when running real commands
+        self.native_probes = type(self.runner) is SubprocessRunner
+        self.check_intervals = dict(self.DEFAULT_CHECK_INTERVALS, **(check_intervals or {}))
+        self.cache = CheckCache(cache_file)
+        # Upper bound for each check and for every command a check runs
+        self.check_timeout = check_timeout
+        self.executor = self._new_executor()
+        # Checks that overran and whose thread is still running; Python threads cannot be
+        # cancelled, so such a check is not started again until the stuck call returns
+        self._stuck: Dict[str, Any] = {}
+        # Resource budget: concurrent commands, and whether expensive checks wait for an idle host
+        self._subprocess_slots = threading.BoundedSemaphore(max_subprocesses)
+        self.defer_when_busy = defer_when_busy
+        self._deferred_until: Dict[str, float] = {}
+        # Background metric sampling, started by the daemon
+        self.sampler: Optional[MetricSampler] = None
+        self.operating_system = operating_system or platform.system()
+        facts = self._host_facts(state_file)
+        self.machine_id = facts["machine_id"]
+        self.hostname = facts["hostname"]
+        self.os_version = facts["os_version"]
+        # Check-in schedule handed out by the server with the last response, if any
+        self.next_check_in_after: Optional[int] = None
+        self.jitter_seconds = 0
+        # Whether the server advertised MessagePack uploads (Accept-Post) on an earlier response
+        self.server_accepts_msgpack = False
+        self._session = None
+        self._cpu_primed = False
+    
+    @property
+    def session(self) -> "requests.Session":
+        """One pooled keep-alive session, so reports reuse the TCP/TLS connection"""
+        if self._session is None:
+            session = requests.Session()
+            session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+            session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+            self._session = session
+        return self._session
+
+    def _run(self, command: list, check: bool = True) -> subprocess.CompletedProcess:
+        """Run a command, killing it if it outlives the check timeout"""
+        if not self._subprocess_slots.acquire(timeout=self.check_timeout):
+            raise subprocess.TimeoutExpired(command, self.check_timeout)
+        try:
+            result = self.runner.run(command, timeout=self.check_timeout)
+        finally:
+            self._subprocess_slots.release()
+        if check and result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, command, result.stdout, result.stderr)
+        return result
+    
+    def _host_facts(self, state_file: Optional[str]) -> Dict[str, str]:
+        """Identity and static host facts, from the state file while it still matches this host"""
+        state, key, now = HostState(state_file), HostState.host_key(self.operating_system), time.time()
+        facts = state.get(key, now)
+        if facts is None:
+            machine_id = self._get_machine_id()
+            facts = {"machine_id": machine_id or platform.node(),
+                     "hostname": platform.node(),
+                     "os_version": platform.version()}
+            # A hostname fallback is not worth keeping; try the real identity again next start
+            if machine_id:
+                state.put(key, facts, now)
+        return facts
+    
+    def _get_machine_id(self) -> Optional[str]:
+        """Get unique machine identifier, or None if the platform would not tell"""
+        if self.operating_system == "Windows":
             try:
-                result = subprocess.run(['wmic', 'csproduct', 'get', 'uuid'], 
-                                      capture_output=True, text=True, check=True)
+                result = self._run(['wmic', 'csproduct', 'get', 'uuid'])
                 lines = result.stdout.strip().split('\n')
                 if len(lines) >= 2:
                     return lines[1].strip()
             except:
                 pass
-            return platform.node()
-        elif platform.system() == "Darwin":  # macOS
+            return None
+        elif self.operating_system == "Darwin":  # macOS
             try:
-                result = subprocess.run(['system_profiler', 'SPHardwareDataType'], 
-                                      capture_output=True, text=True, check=True)
+                result = self._run(['system_profiler', 'SPHardwareDataType'])
                 for line in result.stdout.split('\n'):
                     if 'Serial Number' in line:
                         return line.split(':')[1].strip()
             except:
                 pass
-            return platform.node()
+            return None
         else:  # Linux
             try:
                 with open('/etc/machine-id', 'r') as f:
                     return f.read().strip()
             except:
                 pass
-            return platform.node()
+            return None
     
     def check_disk_encryption(self) -> Dict[str, Any]:
         """Check disk encryption status"""
         try:
-            if platform.system() == "Windows":
+            if self.operating_system == "Windows":
                 return self._check_windows_disk_encryption()
-            elif platform.system() == "Darwin":
+            elif self.operating_system == "Darwin":
                 return self._check_macos_disk_encryption()
             else:
                 return self._check_linux_disk_encryption()
@@ -85,8 +713,7 @@ class SystemHealthChecker:
     def _check_windows_disk_encryption(self) -> Dict[str, Any]:
         """Check Windows BitLocker status"""
         try:
-            result = subprocess.run(['manage-bde', '-status'], 
-                                  capture_output=True, text=True, check=True)
+            result = self._run(['manage-bde', '-status'])
             return {
                 "encrypted": "Protection On" in result.stdout,
                 "details": "BitLocker enabled" if "Protection On" in result.stdout else "BitLocker disabled"
@@ -97,8 +724,7 @@ class SystemHealthChecker:
     def _check_macos_disk_encryption(self) -> Dict[str, Any]:
         """Check macOS FileVault status"""
         try:
-            result = subprocess.run(['fdesetup', 'status'], 
-                                  capture_output=True, text=True, check=True)
+            result = self._run(['fdesetup', 'status'])
             return {
                 "encrypted": "FileVault is On" in result.stdout,
                 "details": "FileVault enabled" if "FileVault is On" in result.stdout else "FileVault disabled"
@@ -108,10 +734,15 @@ class SystemHealthChecker:
     
     def _check_linux_disk_encryption(self) -> Dict[str, Any]:
         """Check Linux disk encryption status"""
+        devices = _linux_luks_devices() if self.native_probes else None
+        if devices is not None:
+            return {
+                "encrypted": bool(devices),
+                "details": f"LUKS encryption detected ({', '.join(devices)})" if devices else "No LUKS encryption"
+            }
         try:
-            # Check if LUKS is used
-            result = subprocess.run(['lsblk', '-f'], 
-                                  capture_output=True, text=True, check=True)
+            # No sysfs, nor /proc/partitions with a udev database (e.g. some containers); ask lsblk
+            result = self._run(['lsblk', '-f'])
             return {
                 "encrypted": "crypto_LUKS" in result.stdout,
                 "details": "LUKS encryption detected" if "crypto_LUKS" in result.stdout else "No LUKS encryption"
@@ -122,9 +753,9 @@ class SystemHealthChecker:
     def check_os_updates(self) -> Dict[str, Any]:
         """Check OS update status"""
         try:
-            if platform.system() == "Windows":
+            if self.operating_system == "Windows":
                 return self._check_windows_updates()
-            elif platform.system() == "Darwin":
+            elif self.operating_system == "Darwin":
                 return self._check_macos_updates()
             else:
                 return self._check_linux_updates()
@@ -135,8 +766,7 @@ class SystemHealthChecker:
     def _check_windows_updates(self) -> Dict[str, Any]:
         """Check Windows update status"""
         try:
-            result = subprocess.run(['wmic', 'qfe', 'list', 'brief'], 
-                                  capture_output=True, text=True, check=True)
+            result = self._run(['wmic', 'qfe', 'list', 'brief'])
             # This is a simplified check - in production you'd want more sophisticated logic
             return {
                 "up_to_date": True,  # Simplified for demo
@@ -149,8 +779,7 @@ class SystemHealthChecker:
     def _check_macos_updates(self) -> Dict[str, Any]:
         """Check macOS update status"""
         try:
-            result = subprocess.run(['softwareupdate', '-l'], 
-                                  capture_output=True, text=True, check=True)
+            result = self._run(['softwareupdate', '-l'])
             return {
                 "up_to_date": "No updates available" in result.stdout,
                 "details": "No updates available" if "No updates available" in result.stdout else "Updates available",
@@ -163,8 +792,7 @@ class SystemHealthChecker:
         """Check Linux update status"""
         try:
             # Check for available updates (Ubuntu/Debian)
-            result = subprocess.run(['apt', 'list', '--upgradable'], 
-                                  capture_output=True, text=True, check=True)
+            result = self._run(['apt', 'list', '--upgradable'])
             return {
                 "up_to_date": "WARNING" not in result.stdout,
                 "details": "No updates available" if "WARNING" not in result.stdout else "Updates available",
@@ -179,9 +807,9 @@ class SystemHealthChecker:
     def check_antivirus(self) -> Dict[str, Any]:
         """Check antivirus presence and status"""
         try:
-            if platform.system() == "Windows":
+            if self.operating_system == "Windows":
                 return self._check_windows_antivirus()
-            elif platform.system() == "Darwin":
+            elif self.operating_system == "Darwin":
                 return self._check_macos_antivirus()
             else:
                 return self._check_linux_antivirus()
@@ -192,8 +820,7 @@ class SystemHealthChecker:
     def _check_windows_antivirus(self) -> Dict[str, Any]:
         """Check Windows antivirus status"""
         try:
-            result = subprocess.run(['wmic', '/namespace:\\\\root\\SecurityCenter2', 'path', 'AntiVirusProduct', 'get', 'displayName,productState'], 
-                                  capture_output=True, text=True, check=True)
+            result = self._run(['wmic', '/namespace:\\\\root\\SecurityCenter2', 'path', 'AntiVirusProduct', 'get', 'displayName,productState'])
             return {
                 "active": "262144" in result.stdout,  # 262144 indicates real-time protection is on
                 "details": "Windows Defender active" if "262144" in result.stdout else "Windows Defender inactive",
@@ -208,9 +835,7 @@ class SystemHealthChecker:
             # Check for common macOS antivirus tools
             common_av = ['clamav', 'sophos', 'malwarebytes']
             for av in common_av:
-                result = subprocess.run(['which', av], 
-                                      capture_output=True, text=True, check=False)
-                if result.returncode == 0:
+                if self.runner.which(av):
                     return {"active": True, "details": f"{av} found", "product": av}
             
             return {"active": False, "details": "No common antivirus found"}
@@ -221,11 +846,8 @@ class SystemHealthChecker:
         """Check Linux antivirus status"""
         try:
             # Check for common Linux antivirus tools
-            common_av = ['clamav', 'chkrootkit', 'rkhunter']
-            for av in common_av:
-                result = subprocess.run(['which', av], 
-                                      capture_output=True, text=True, check=False)
-                if result.returncode == 0:
+            for av in LINUX_ANTIVIRUS:
+                if self.runner.which(av):
                     return {"active": True, "details": f"{av} found", "product": av}
             
             return {"active": False, "details": "No common antivirus found"}
@@ -235,9 +857,9 @@ class SystemHealthChecker:
     def check_sleep_settings(self) -> Dict[str, Any]:
         """Check inactivity sleep settings"""
         try:
-            if platform.system() == "Windows":
+            if self.operating_system == "Windows":
                 return self._check_windows_sleep_settings()
-            elif platform.system() == "Darwin":
+            elif self.operating_system == "Darwin":
                 return self._check_macos_sleep_settings()
             else:
                 return self._check_linux_sleep_settings()
@@ -248,8 +870,7 @@ class SystemHealthChecker:
     def _check_windows_sleep_settings(self) -> Dict[str, Any]:
         """Check Windows power settings"""
         try:
-            result = subprocess.run(['powercfg', '/query'], 
-                                  capture_output=True, text=True, check=True)
+            result = self._run(['powercfg', '/query'])
             # This is a simplified check
             return {
                 "compliant": True,  # Simplified for demo
@@ -262,8 +883,7 @@ class SystemHealthChecker:
     def _check_macos_sleep_settings(self) -> Dict[str, Any]:
         """Check macOS sleep settings"""
         try:
-            result = subprocess.run(['pmset', '-g'], 
-                                  capture_output=True, text=True, check=True)
+            result = self._run(['pmset', '-g'])
             return {
                 "compliant": True,  # Simplified for demo
                 "details": "Sleep settings checked",
@@ -274,10 +894,17 @@ class SystemHealthChecker:
     
     def _check_linux_sleep_settings(self) -> Dict[str, Any]:
         """Check Linux sleep settings"""
+        logind = _logind_config() if self.native_probes else None
+        if logind is not None:
+            return {
+                "compliant": True,  # Simplified for demo
+                "details": "Sleep settings checked",
+                "timeout": logind.get("IdleActionSec", "Unknown"),
+                "idle_action": logind.get("IdleAction", "ignore")
+            }
         try:
             # Check systemd sleep settings
-            result = subprocess.run(['systemctl', 'show', 'sleep.target'], 
-                                  capture_output=True, text=True, check=True)
+            result = self._run(['systemctl', 'show', 'sleep.target'])
             return {
                 "compliant": True,  # Simplified for demo
                 "details": "Sleep settings checked",
@@ -290,7 +917,7 @@ class SystemHealthChecker:
         """Get current system metrics"""
         try:
             return {
-                "cpu_usage": psutil.cpu_percent(interval=1),
+                "cpu_usage": psutil.cpu_percent(interval=None),
                 "memory_usage": psutil.virtual_memory().percent,
                 "disk_usage": psutil.disk_usage('/').percent,
                 "network_status": "connected" if psutil.net_if_stats() else "disconnected"
@@ -304,16 +931,32 @@ class SystemHealthChecker:
                 "network_status": "unknown"
             }
     
-    def run_health_check(self) -> Dict[str, Any]:
-        """Run complete system health check"""
+    def run_health_check(self, force: bool = False) -> Dict[str, Any]:
+        """Run complete system health check, reusing cached results that are still fresh"""
         logger.info("Starting system health check...")
+        if not self._cpu_primed:
+            # Prime psutil so later cpu_percent() calls measure since the previous call without blocking
+            psutil.cpu_percent(interval=None)
+            self._cpu_primed = True
         
-        # Run all checks
-        disk_encryption = self.check_disk_encryption()
-        os_updates = self.check_os_updates()
-        antivirus = self.check_antivirus()
-        sleep_settings = self.check_sleep_settings()
-        system_metrics = self.get_system_metrics()
+        # Run due checks concurrently; the cycle takes as long as the slowest one
+        results = self._run_checks({
+            "disk_encryption": (self.check_disk_encryption,
+                                {"encrypted": False, "details": "Disk encryption check timed out"}),
+            "os_updates": (self.check_os_updates,
+                           {"up_to_date": False, "details": "OS update check timed out"}),
+            "antivirus": (self.check_antivirus,
+                          {"active": False, "details": "Antivirus check timed out"}),
+            "sleep_settings": (self.check_sleep_settings,
+                               {"compliant": False, "details": "Sleep settings check timed out"}),
+            "metrics": (self.get_system_metrics,
+                        {"cpu_usage": 0, "memory_usage": 0, "disk_usage": 0, "network_status": "unknown"}),
+        }, force=force)
+        disk_encryption = results["disk_encryption"]
+        os_updates = results["os_updates"]
+        antivirus = results["antivirus"]
+        sleep_settings = results["sleep_settings"]
+        system_metrics = results["metrics"]
         
         # Compile results
         health_data = {
@@ -368,56 +1011,319 @@ class SystemHealthChecker:
         logger.info(f"Health check completed. Found {len(health_data['issues'])} issues.")
         return health_data
     
+    def _can_defer(self, name: str, now: float) -> bool:
+        age = self.cache.age(name, now)
+        return (self.defer_when_busy and name in self.EXPENSIVE_CHECKS and age is not None
+                and age < self.check_intervals[name] + self.MAX_DEFERRAL)
+    
+    def _busy_reason(self) -> Optional[str]:
+        """Why expensive checks should wait, or None if the host is idle and on AC power"""
+        try:
+            battery = psutil.sensors_battery()
+            if battery is not None and not battery.power_plugged:
+                return "on battery"
+            load = psutil.getloadavg()[0] / (psutil.cpu_count() or 1)
+            if load > self.BUSY_LOAD_PER_CORE:
+                return f"load {load:.2f} per core"
+        except (AttributeError, OSError, RuntimeError):
+            pass
+        return None
+    
+    def invalidate(self, names: set):
+        """Force the named checks to run on the next health check"""
+        for name in names:
+            self.cache.invalidate(name)
+    
+    def next_check_due(self) -> float:
+        """Seconds until the next check is due to run again"""
+        return self.cache.next_due(self.check_intervals, time.time(), self._deferred_until)
+    
+    def _new_executor(self) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=5, thread_name_prefix="health-check")
+    
+    def _run_checks(self, checks: Dict[str, Any], force: bool = False) -> Dict[str, Dict[str, Any]]:
+        """Run due checks on the executor and return each result, or its fallback if it overran"""
+        now = time.time()
+        results = {}
+        if not force:
+            for name in checks:
+                cached = self.cache.get(name, self.check_intervals[name], now)
+                if cached is not None:
+                    results[name] = cached
+            
+            deferrable = [name for name in checks if name not in results and self._can_defer(name, now)]
+            reason = self._busy_reason() if deferrable else None
+            if reason:
+                for name in deferrable:
+                    logger.info(f"Deferring {name} check ({reason})")
+                    results[name] = self.cache.entries[name]["result"]
+                    self._deferred_until[name] = now + self.FAILED_CHECK_RETRY
+        
+        for name in checks:
+            stuck = self._stuck.get(name)
+            if stuck is not None and stuck.done():
+                del self._stuck[name]
+        
+        started: Dict[str, float] = {}
+        
+        def timed(name, func):
+            started[name] = time.monotonic()
+            return func()
+        
+        submitted = time.monotonic()
+        futures = {name: self.executor.submit(timed, name, func)
+                   for name, (func, _) in checks.items() if name not in results and name not in self._stuck}
+        
+        timed_out = {name for name in checks if name in self._stuck and name not in results}
+        # Each check gets check_timeout from when it starts running (or was queued, if it never did)
+        pending = set(futures)
+        while pending:
+            current = time.monotonic()
+            deadlines = {name: started.get(name, submitted) + self.check_timeout for name in pending}
+            for name in list(pending):
+                if futures[name].done():
+                    pending.discard(name)
+                elif deadlines[name] <= current:
+                    pending.discard(name)
+                    timed_out.add(name)
+            if pending:
+                wait([futures[name] for name in pending],
+                     timeout=min(deadlines[name] for name in pending) - current, return_when=FIRST_COMPLETED)
+        
+        abandoned = False
+        for name in timed_out:
+            future = futures.get(name)
+            # cancel() only stops checks still queued; a running probe keeps its thread
+            if future is not None and not future.cancel():
+                self._stuck[name] = future
+                abandoned = True
+        if abandoned:
+            # Leave the stuck threads to the old pool so they cannot starve later checks
+            self.executor.shutdown(wait=False)
+            self.executor = self._new_executor()
+        
+        for name in list(futures) + sorted(timed_out - set(futures)):
+            fallback = checks[name][1]
+            if name not in futures:
+                logger.warning(f"{name} check is still stuck in an earlier run; not starting it again")
+                results[name] = dict(fallback)
+            elif name in timed_out:
+                logger.warning(f"{name} check did not finish within {self.check_timeout}s")
+                results[name] = dict(fallback)
+            else:
+                try:
+                    results[name] = futures[name].result()
+                    self.cache.put(name, results[name], now)
+                    continue
+                except Exception as e:
+                    logger.error(f"Error running {name} check: {e}")
+                    results[name] = dict(fallback)
+            # Keep the failure for a few minutes so a broken check is retried, not spun on
+            ttl = self.check_intervals[name]
+            self.cache.put(name, results[name], now - ttl + min(ttl, self.FAILED_CHECK_RETRY))
+        
+        if futures or timed_out:
+            self.cache.save()
+        return results
+    
+    def build_report(self, health_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn a health check result into the payload the API expects"""
+        report = {
+            "machine_id": health_data["machine_id"],
+            "hostname": health_data["hostname"],
+            "operating_system": health_data["operating_system"],
+            "os_version": health_data["os_version"],
+            "disk_encrypted": health_data["checks"]["disk_encryption"]["encrypted"],
+            "os_up_to_date": health_data["checks"]["os_updates"]["up_to_date"],
+            "antivirus_active": health_data["checks"]["antivirus"]["active"],
+            "sleep_settings_compliant": health_data["checks"]["sleep_settings"]["compliant"],
+            # The API stores whole percentages
+            "cpu_usage": round(health_data["metrics"]["cpu_usage"]),
+            "memory_usage": round(health_data["metrics"]["memory_usage"]),
+            "disk_usage": round(health_data["metrics"]["disk_usage"]),
+            "network_status": health_data["metrics"]["network_status"],
+            "issues": health_data["issues"]
+        }
+        summary = self.sampler.summarize() if self.sampler is not None else None
+        if summary:
+            report["metrics_summary"] = summary
+        return report
+    
     def send_health_data(self, health_data: Dict[str, Any]) -> bool:
         """Send health data to the API endpoint"""
         try:
-            # Prepare data for API
-            api_data = {
-                "machine_id": health_data["machine_id"],
-                "hostname": health_data["hostname"],
-                "operating_system": health_data["operating_system"],
-                "os_version": health_data["os_version"],
-                "disk_encrypted": health_data["checks"]["disk_encryption"]["encrypted"],
-                "os_up_to_date": health_data["checks"]["os_updates"]["up_to_date"],
-                "antivirus_active": health_data["checks"]["antivirus"]["active"],
-                "sleep_settings_compliant": health_data["checks"]["sleep_settings"]["compliant"],
-                "cpu_usage": health_data["metrics"]["cpu_usage"],
-                "memory_usage": health_data["metrics"]["memory_usage"],
-                "disk_usage": health_data["metrics"]["disk_usage"],
-                "network_status": health_data["metrics"]["network_status"],
-                "issues": health_data["issues"]
-            }
-            
             # Send to machines endpoint
-            response = requests.post(
-                f"{self.api_endpoint}/api/machines",
-                json=api_data,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                logger.info("Health data sent successfully")
-                return True
-            else:
-                logger.error(f"Failed to send health data: {response.status_code} - {response.text}")
-                return False
-                
+            response = self._post("/api/machines", self.build_report(health_data))
+            sent = self._handle_response(response, "health data")
+            if sent:
+                self.metrics_delivered()
+            return sent
         except requests.exceptions.RequestException as e:
             logger.error(f"Error sending health data: {e}")
             return False
         except Exception as e:
             logger.error(f"Unexpected error sending health data: {e}")
             return False
+    
+    def send_heartbeat(self) -> Optional[bool]:
+        """Tell the API we are alive without re-sending unchanged state.
+
+        Returns None when the server does not know this machine and needs a full report.
+        """
+        try:
+            summary = self.sampler.summarize() if self.sampler is not None else None
+            response = self._post(f"/api/machines/{self.machine_id}/heartbeat",
+                                  {"metrics_summary": summary} if summary else {})
+            if response.status_code == 404:
+                return None
+            sent = self._handle_response(response, "heartbeat")
+            if sent:
+                self.metrics_delivered()
+            return sent
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error sending heartbeat: {e}")
+            return False
+    
+    def metrics_delivered(self):
+        """The last metric summary reached the API or the spool; start the next window"""
+        if self.sampler is not None:
+            self.sampler.commit()
+    
+    def send_report_batch(self, reports: list) -> Optional[bool]:
+        """Send spooled reports in one gzip-compressed request.
+
+        Returns True when accepted, False when worth retrying later and None when
+        the server rejected the batch outright (too large or invalid). Any other
+        failure keeps the reports spooled, since dropping them loses the backlog.
+        """
+        try:
+            response = self._post("/api/machines/batch", reports, compress=True)
+            if self._handle_response(response, f"{len(reports)} spooled reports"):
+                return True
+            if response.status_code in self.REJECTED_STATUSES:
+                return None
+            return False
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error sending spooled reports: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Unexpected error sending spooled reports: {e}")
+            return False
+    
+    def _handle_response(self, response: "requests.Response", what: str) -> bool:
+        if response.status_code == 200:
+            logger.info(f"Sent {what} successfully")
+            self._update_schedule(response.json())
+            return True
+        elif response.status_code in (429, 503):
+            logger.warning(f"Server deferred {what}: {response.status_code}")
+            self._update_schedule(response.json().get("detail", {}), response.headers.get("Retry-After"))
+            return False
+        else:
+            logger.error(f"Failed to send {what}: {response.status_code} - {response.text}")
+            return False
+    
+    def _post(self, path: str, payload: Any, compress: bool = False) -> "requests.Response":
+        """POST with retries: exponential backoff with full jitter, honoring Retry-After"""
+        binary = self.server_accepts_msgpack
+        headers, body = self._encode(payload, compress, binary)
+        
+        for attempt in range(self.MAX_RETRIES + 1):
+            try:
+                response = self.session.post(f"{self.api_endpoint}{path}", data=body, headers=headers,
+                                             timeout=self.REQUEST_TIMEOUT)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.MAX_RETRIES:
+                    raise
+                response = None
+            
+            if response is not None:
+                self._learn_formats(response)
+                if binary and not self.server_accepts_msgpack:
+                    # The server stopped taking MessagePack; say it again in JSON
+                    return self._post(path, payload, compress)
+            if response is not None and response.status_code not in self.RETRY_STATUSES:
+                return response
+            if attempt == self.MAX_RETRIES:
+                return response
+            
+            delay = random.uniform(0, self.RETRY_BACKOFF * 2 ** attempt)
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            if retry_after is not None:
+                try:
+                    delay = float(retry_after)
+                except ValueError:
+                    pass
+                if delay > self.MAX_RETRY_WAIT:
+                    # The server wants us gone for a while; leave it to the check-in schedule
+                    return response
+            logger.info(f"Retrying {path} in {delay:.1f}s (attempt {attempt + 2} of {self.MAX_RETRIES + 1})")
+            time.sleep(delay)
+    
+    def _encode(self, payload: Any, compress: bool, binary: bool):
+        """Serialize a payload as MessagePack when negotiated, JSON otherwise"""
+        if binary:
+            headers = {"Content-Type": "application/msgpack"}
+            body = msgpack.packb(payload, use_bin_type=True)
+        else:
+            headers = {"Content-Type": "application/json"}
+            body = json.dumps(payload).encode()
+        if compress:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        return headers, body
+    
+    def _learn_formats(self, response: "requests.Response"):
+        """Follow the upload formats the server advertises"""
+        accept_post = response.headers.get("Accept-Post", "")
+        formats = {part.split(";")[0].strip().lower() for part in accept_post.split(",")}
+        self.server_accepts_msgpack = msgpack is not None and "application/msgpack" in formats
+    
+    def _update_schedule(self, body: Any, retry_after: Optional[str] = None):
+        """Remember when the server asked us to check in next"""
+        if not isinstance(body, dict):
+            body = {}
+        delay = body.get("next_check_in_after", retry_after)
+        try:
+            self.next_check_in_after = int(float(delay)) if delay is not None else None
+            self.jitter_seconds = int(body.get("jitter_seconds", 0))
+        except (TypeError, ValueError):
+            self.next_check_in_after = None
+            self.jitter_seconds = 0
 
 class SystemUtility:
     """Main system utility class"""
     
-    def __init__(self, api_endpoint: str = "http://localhost:8000", check_interval: int = 30):
+    # With inotify watches in place, polling of watched checks is only a safety net
+    WATCHED_INTERVAL_FACTOR = 4
+    
+    def __init__(self, api_endpoint: str = "http://localhost:8000", check_interval: int = 30,
+                 startup_jitter: int = 60, check_timeout: int = 60,
+                 check_intervals: Optional[Dict[str, float]] = None, cache_file: Optional[str] = None,
+                 spool_file: Optional[str] = None, watch: bool = True, budget: bool = False,
+                 sample_interval: float = 5.0, state_file: Optional[str] = None):
         self.api_endpoint = api_endpoint
+        self.sample_interval = sample_interval
         self.check_interval = check_interval
-        self.health_checker = SystemHealthChecker(api_endpoint)
+        self.startup_jitter = startup_jitter
+        # Resource-budget mode: one command at a time and expensive checks wait for an idle host
+        self.budget = budget
+        self.health_checker = SystemHealthChecker(api_endpoint, check_timeout, check_intervals, cache_file,
+                                                  max_subprocesses=1 if budget else 5,
+                                                  defer_when_busy=budget, state_file=state_file)
+        # CPU time, RSS and wall time of the last daemon cycle
+        self.cycle_stats: Dict[str, float] = {}
+        # Reports that could not be delivered wait here until the API is reachable again;
+        # opened by the daemon or the first failed delivery, so one-off runs never create it
+        self.spool_file = spool_file
+        self.spool: Optional[ReportSpool] = None
+        self.watch = watch
         self.running = False
         self.last_check_data = None
+        # Checks flagged by the file watcher, applied by the daemon loop
+        self._triggered_checks = set()
+        self._trigger_lock = threading.Lock()
+        self._wakeup = threading.Event()
         
     def start_daemon(self):
         """Start the background daemon"""
@@ -428,24 +1334,54 @@ class SystemUtility:
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
         
+        if self.budget:
+            self._lower_priority()
+        # Reports spooled by an earlier run go out before anything new
+        self._open_spool()
+        
+        watcher = None
         try:
+            # Spread out agents that all start at boot
+            if self.startup_jitter > 0:
+                self._sleep(random.uniform(0, self.startup_jitter))
+            
+            watcher = self._start_watcher() if self.watch else None
+            if self.sample_interval > 0:
+                self.health_checker.sampler = MetricSampler(self.sample_interval)
+                self.health_checker.sampler.start()
+            
+            next_check_in = time.monotonic()
             while self.running:
-                # Run health check
+                cycle_start, usage_start = time.perf_counter(), resource_usage()
+                with self._trigger_lock:
+                    triggered, self._triggered_checks = self._triggered_checks, set()
+                    self._wakeup.clear()
+                self.health_checker.invalidate(triggered)
+                
+                # Run the checks that are due; fresh cached results are reused
                 health_data = self.health_checker.run_health_check()
                 
                 # Check if data has changed
+                sent = False
                 if self._has_data_changed(health_data):
                     logger.info("System state changed, sending update...")
-                    if self.health_checker.send_health_data(health_data):
-                        self.last_check_data = health_data
+                    sent = self._deliver(health_data)
+                    if sent:
                         logger.info("Update sent successfully")
                     else:
                         logger.warning("Failed to send update")
                 else:
                     logger.info("No changes detected, skipping update")
                 
-                # Wait for next check
-                time.sleep(self.check_interval * 60)
+                # Wait until the next check is due or the server expects us, whichever is first
+                if time.monotonic() >= next_check_in:
+                    if self.spool is not None and len(self.spool):
+                        sent = self._flush_spool()
+                    if not sent:
+                        self._check_in(health_data)
+                    next_check_in = time.monotonic() + self._next_check_delay()
+                self._record_cycle(cycle_start, usage_start)
+                self._sleep(min(next_check_in - time.monotonic(), self.health_checker.next_check_due()))
                 
         except KeyboardInterrupt:
             logger.info("Received interrupt signal, shutting down...")
@@ -453,38 +1389,116 @@ class SystemUtility:
             logger.error(f"Unexpected error in daemon: {e}")
         finally:
             self.running = False
+            if watcher is not None:
+                watcher.stop()
+            if self.health_checker.sampler is not None:
+                self.health_checker.sampler.stop()
             logger.info("System utility daemon stopped")
     
+    def _check_in(self, health_data: Dict[str, Any]):
+        """Keep the machine online with a heartbeat, or a full report if the server lost it"""
+        if self.last_check_data is None or (self.spool is not None and len(self.spool)):
+            return
+        if self.health_checker.send_heartbeat() is None:
+            logger.info("Server does not know this machine, sending full report...")
+            self._deliver(health_data)
+    
+    def _deliver(self, health_data: Dict[str, Any]) -> bool:
+        """Send a report, spooling it when the API cannot take it now"""
+        checker = self.health_checker
+        # Queue behind older spooled reports so the server sees them in order
+        if (self.spool is None or not len(self.spool)) and checker.send_health_data(health_data):
+            self.last_check_data = health_data
+            return True
+        if self._open_spool() is None:
+            return False
+        report = checker.build_report(health_data)
+        report["collected_at"] = health_data["timestamp"]
+        self.spool.append(report)
+        # The spooled report carries the metric summary now
+        checker.metrics_delivered()
+        # Durable now, so the next cycle need not resend the same state
+        self.last_check_data = health_data
+        return len(self.spool) > 1 and self._flush_spool()
+    
+    def _flush_spool(self, batch_size: int = 100) -> bool:
+        """Replay spooled reports oldest first; True once the spool is empty"""
+        while True:
+            batch = self.spool.peek(batch_size)
+            if not batch:
+                return True
+            result = self.health_checker.send_report_batch([report for _, report in batch])
+            if result is False:
+                return False
+            if result is None:
+                logger.error(f"Dropping {len(batch)} spooled reports rejected by the server")
+            self.spool.remove([row_id for row_id, _ in batch])
+    
+    def _open_spool(self) -> Optional[ReportSpool]:
+        """The report spool, opened (and created) on first use; None when spooling is off"""
+        if self.spool is None and self.spool_file:
+            self.spool = ReportSpool(self.spool_file)
+        return self.spool
+    
+    def _next_check_delay(self) -> float:
+        """Seconds to wait before the next check: the server's schedule if it sent one"""
+        checker = self.health_checker
+        if checker.next_check_in_after is None:
+            return self.check_interval * 60
+        return checker.next_check_in_after + random.uniform(0, checker.jitter_seconds)
+    
+    def _lower_priority(self):
+        """Run at the lowest CPU and I/O priority the platform offers"""
+        process = psutil.Process()
+        try:
+            if platform.system() == "Windows":
+                process.nice(psutil.IDLE_PRIORITY_CLASS)
+                process.ionice(psutil.IOPRIO_VERYLOW)
+            else:
+                process.nice(19)
+                if hasattr(psutil, "IOPRIO_CLASS_IDLE"):
+                    process.ionice(psutil.IOPRIO_CLASS_IDLE)
+        except (psutil.Error, AttributeError, OSError) as e:
+            logger.warning(f"Could not lower process priority: {e}")
+    
+    def _record_cycle(self, cycle_start: float, usage_start: Dict[str, float]):
+        usage = resource_usage()
+        self.cycle_stats = {
+            "wall_seconds": time.perf_counter() - cycle_start,
+            "cpu_seconds": usage["cpu_seconds"] - usage_start["cpu_seconds"],
+            "rss_mb": usage["rss_mb"],
+        }
+        logger.info(f"Cycle took {self.cycle_stats['wall_seconds']:.2f}s wall, "
+                    f"{self.cycle_stats['cpu_seconds']:.3f}s CPU, {self.cycle_stats['rss_mb']:.1f} MB RSS")
+    
+    def _start_watcher(self) -> Optional[InotifyWatcher]:
+        """Re-check on file changes; watched checks then only need a slow safety-net poll"""
+        watcher = InotifyWatcher(self._on_watch_trigger)
+        if not watcher.start():
+            return None
+        intervals = self.health_checker.check_intervals
+        for check in watcher.watched_checks():
+            intervals[check] *= self.WATCHED_INTERVAL_FACTOR
+        logger.info(f"Watching for changes affecting: {', '.join(sorted(watcher.watched_checks()))}")
+        return watcher
+    
+    def _on_watch_trigger(self, checks: set):
+        with self._trigger_lock:
+            self._triggered_checks |= checks
+        self._wakeup.set()
+    
+    def _sleep(self, seconds: float):
+        """Sleep in short steps so a shutdown signal or a file change is noticed promptly"""
+        deadline = time.monotonic() + seconds
+        while self.running and time.monotonic() < deadline:
+            if self._wakeup.wait(min(1.0, deadline - time.monotonic())):
+                return
+    
     def _has_data_changed(self, new_data: Dict[str, Any]) -> bool:
         """Check if the new health data represents a change from the last check"""
         if self.last_check_data is None:
             return True
-        
-        # Compare key fields
-        old_checks = self.last_check_data.get("checks", {})
-        new_checks = new_data.get("checks", {})
-        
-        # Check if any critical fields have changed
-        for check_type in ["disk_encryption", "os_updates", "antivirus", "sleep_settings"]:
-            old_status = old_checks.get(check_type, {})
-            new_status = new_checks.get(check_type, {})
-            
-            if old_status != new_status:
-                return True
-        
-        # Check if issues have changed
-        old_issues = self.last_check_data.get("issues", [])
-        new_issues = new_data.get("issues", [])
-        
-        if len(old_issues) != len(new_issues):
-            return True
-        
-        # Check if any issues have changed
-        for old_issue, new_issue in zip(old_issues, new_issues):
-            if old_issue != new_issue:
-                return True
-        
-        return False
+        return fingerprint(new_data) != fingerprint(self.last_check_data)
     
     def _signal_handler(self, signum, frame):
         """Handle shutdown signals"""
@@ -494,7 +1508,7 @@ class SystemUtility:
     def run_single_check(self):
         """Run a single health check and display results"""
         logger.info("Running single health check...")
-        health_data = self.health_checker.run_health_check()
+        health_data = self.health_checker.run_health_check(force=True)
         
         print("\n=== Solsphere System Health Check ===")
         print(f"Machine ID: {health_data['machine_id']}")
@@ -546,7 +1560,28 @@ def main():
     parser.add_argument("--api-endpoint", default="http://localhost:8000",
                        help="API endpoint URL (default: http://localhost:8000)")
     parser.add_argument("--check-interval", type=int, default=30,
-                       help="Check interval in minutes (default: 30)")
+                       help="Check interval in minutes, used until the server sends a schedule (default: 30)")
+    parser.add_argument("--startup-jitter", type=int, default=60,
+                       help="Maximum random delay in seconds before the first daemon check (default: 60)")
+    parser.add_argument("--check-timeout", type=int, default=60,
+                       help="Seconds before a single check or command is abandoned (default: 60)")
+    parser.add_argument("--check-schedule", default="",
+                       help="Per-check intervals in seconds, e.g. os_updates=14400,metrics=60")
+    parser.add_argument("--cache-file", default="solsphere_check_cache.json",
+                       help="File that keeps check results across restarts ('' to disable)")
+    parser.add_argument("--spool-file", default="solsphere_spool.db",
+                       help="SQLite file holding reports until the API is reachable ('' to disable)")
+    parser.add_argument("--state-file", default="solsphere_state.json",
+                       help="File that keeps the machine identity across restarts ('' to disable)")
+    parser.add_argument("--no-watch", action="store_true",
+                       help="Disable re-checks triggered by file changes (Linux inotify)")
+    parser.add_argument("--budget", action="store_true",
+                       help="Resource-budget mode: lowest CPU/IO priority, one command at a time, "
+                            "expensive checks deferred while on battery or under load")
+    parser.add_argument("--sample-interval", type=float, default=5.0,
+                       help="Seconds between background metric samples; 0 disables sampling (default: 5)")
+    parser.add_argument("--record", metavar="FILE",
+                       help="Run every check once and save the command outputs as a replay fixture")
     parser.add_argument("--daemon", action="store_true",
                        help="Run as background daemon")
     parser.add_argument("--single-check", action="store_true",
@@ -554,7 +1589,25 @@ def main():
     
     args = parser.parse_args()
     
-    utility = SystemUtility(args.api_endpoint, args.check_interval)
+    check_intervals = {}
+    for item in filter(None, args.check_schedule.split(",")):
+        name, _, seconds = item.partition("=")
+        if name.strip() not in SystemHealthChecker.DEFAULT_CHECK_INTERVALS:
+            parser.error(f"Unknown check in --check-schedule: {name}")
+        check_intervals[name.strip()] = float(seconds)
+    
+    if args.record:
+        recorder = RecordingRunner(SubprocessRunner(), platform.system())
+        checker = SystemHealthChecker(args.api_endpoint, args.check_timeout, runner=recorder)
+        checker.run_health_check(force=True)
+        recorder.save(args.record)
+        print(f"Recorded {len(recorder.fixture['commands'])} commands to {args.record}")
+        return
+    
+    utility = SystemUtility(args.api_endpoint, args.check_interval, args.startup_jitter,
+                            args.check_timeout, check_intervals, args.cache_file or None,
+                            args.spool_file or None, not args.no_watch, args.budget,
+                            args.sample_interval, args.state_file or None)
     
     if args.single_check:
         utility.run_single_check()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Command runners for the Solsphere System Utility
+
+Every check goes through a runner instead of calling subprocess directly, so the
+agent can be recorded on a real machine and replayed anywhere: in tests,
+benchmarks and profiling of the output parsing.
+"""
+
+import json
+import shutil
+import subprocess
+from typing import Any, Dict, List, Optional
+
+class CommandRunner:
+    """Runs commands and looks up executables for the health checks"""
+
+    def run(self, command: List[str], timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        raise NotImplementedError
+
+    def which(self, name: str) -> Optional[str]:
+        raise NotImplementedError
+
+class SubprocessRunner(CommandRunner):
+    """The real thing: subprocess and a PATH lookup"""
+
+    def run(self, command: List[str], timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        return subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+
+    def which(self, name: str) -> Optional[str]:
+        return shutil.which(name)
+
+class RecordingRunner(CommandRunner):
+    """Wraps another runner and captures every result as a replayable fixture"""
+
+    def __init__(self, inner: CommandRunner, platform_name: str):
+        self.inner = inner
+        self.fixture: Dict[str, Any] = {"platform": platform_name, "commands": [], "which": {}}
+
+    def run(self, command: List[str], timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        try:
+            result = self.inner.run(command, timeout)
+        except FileNotFoundError:
+            self.fixture["commands"].append({"command": list(command), "missing": True})
+            raise
+        self.fixture["commands"].append({
+            "command": list(command),
+            "returncode": result.returncode,
+            "stdout": result.stdout,
+            "stderr": result.stderr,
+        })
+        return result
+
+    def which(self, name: str) -> Optional[str]:
+        path = self.inner.which(name)
+        self.fixture["which"][name] = path
+        return path
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.fixture, f, indent=2)
+
+class ReplayRunner(CommandRunner):
+    """Answers from a recorded fixture; unrecorded commands behave like missing tools"""
+
+    def __init__(self, fixture: Dict[str, Any]):
+        self.platform = fixture.get("platform")
+        self.which_results = fixture.get("which", {})
+        self.commands = {}
+        for entry in fixture.get("commands", []):
+            self.commands[tuple(entry["command"])] = entry
+
+    @classmethod
+    def load(cls, path: str) -> "ReplayRunner":
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    def run(self, command: List[str], timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        entry = self.commands.get(tuple(command))
+        if entry is None or entry.get("missing"):
+            raise FileNotFoundError(f"No such file or directory: '{command[0]}'")
+        return subprocess.CompletedProcess(command, entry["returncode"], entry["stdout"], entry["stderr"])
+
+    def which(self, name: str) -> Optional[str]:
+        return self.which_results.get(name)
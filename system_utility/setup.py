@@ -24,10 +24,11 @@ setup(
     author_email="admin@solsphere.com",
     url="https://github.com/solsphere/system-utility",
     packages=find_packages(),
-    py_modules=["main"],
+    py_modules=["main", "runners"],
     install_requires=[
         "requests>=2.31.0",
         "psutil>=5.9.6",
+        "msgpack>=1.0.7",
     ],
     extras_require={
         "dev": [